@@ -0,0 +1,371 @@
+"""
+Run the training controller against the in-process fakes of NATS, Elasticsearch and S3 and
+report its performance as JSON:
+- admission: throughput and latency percentiles of gpu_service_inference requests.
+- training_trigger: time from storing new workload parameters to the job published to the
+  GPU service.
+- sampling_plan: time to plan the logs of every workload and interval for several corpus sizes.
+- export: MiB/s of the training data exporter for several corpus sizes and output formats.
+- startup: time from starting a fresh interpreter to the first admission reply.
+
+    python benchmarks/controller_benchmark.py --sizes 10000 100000 --output results.json
+"""
+# Standard Library
+import argparse
+import asyncio
+import json
+import logging
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCHMARKS_DIR, "..", "training_controller"))
+
+# The controller reads its configuration when it is imported.
+WORKING_DIR = tempfile.mkdtemp(prefix="training-controller-benchmark-")
+for name, value in {
+    "ES_ENDPOINT": "https://localhost:9200",
+    "ES_USERNAME": "admin",
+    "ES_PASSWORD": "admin",
+    "S3_ACCESS_KEY": "benchmark",
+    "S3_SECRET_KEY": "benchmark",
+    "S3_ENDPOINT": "http://localhost:9000",
+    "NATS_SERVER_URL": "nats://localhost:4222",
+    "NATS_USERNAME": "benchmark",
+    "NATS_PASSWORD": "benchmark",
+    "TRAINING_DATA_PATH": WORKING_DIR,
+}.items():
+    os.environ.setdefault(name, value)
+
+# Third Party
+from fakes import (  # noqa: E402
+    CORPUS_START_TS,
+    FakeAsyncElasticsearch,
+    FakeNatsWrapper,
+    FakeOpniInternalClient,
+    FakeS3Resource,
+)
+from training_data_writers import TRAINING_FIELDS  # noqa: E402
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def latency_summary(seconds):
+    return {
+        "count": len(seconds),
+        "p50_ms": round(percentile(seconds, 0.5) * 1000, 3),
+        "p99_ms": round(percentile(seconds, 0.99) * 1000, 3),
+        "max_ms": round(max(seconds) * 1000, 3),
+        "mean_ms": round(statistics.mean(seconds) * 1000, 3),
+    }
+
+
+def load_controller(nw, es, s3_resource, opni_client):
+    # Third Party
+    import clients
+    import opni_internal_client
+
+    # The fakes are injected before main is imported, as main fetches the NATS client at import.
+    clients.set_nats_wrapper(nw)
+    clients.set_es_instance(es)
+    clients.set_s3_resource(s3_resource)
+    opni_internal_client.OpniInternalClient = lambda *args, **kwargs: opni_client
+    # Third Party
+    import main
+
+    return main
+
+
+def generate_workloads(num_deployments, seed):
+    workloads = dict()
+    for idx in range(num_deployments):
+        cluster_id = f"cluster-{idx // 100}"
+        namespace_name = f"namespace-{(idx // 10) % 10}"
+        workloads.setdefault(cluster_id, dict()).setdefault(namespace_name, []).append(
+            f"deployment-{seed}-{idx}"
+        )
+    return workloads
+
+
+async def benchmark_admission(controller, nw, num_requests, concurrency):
+    await controller.consume_request()
+    payload = json.dumps({"bucket": "opni-nulog-models", "logs": ["x" * 200]}).encode()
+    latencies = []
+
+    async def send_request(idx):
+        start_time = time.perf_counter()
+        await nw.deliver("gpu_service_inference", payload, reply=f"_INBOX.{idx}")
+        latencies.append(time.perf_counter() - start_time)
+
+    start_time = time.perf_counter()
+    for first_idx in range(0, num_requests, concurrency):
+        await asyncio.gather(
+            *[
+                send_request(idx)
+                for idx in range(first_idx, min(num_requests, first_idx + concurrency))
+            ]
+        )
+    elapsed = time.perf_counter() - start_time
+    result = latency_summary(latencies)
+    result.update(
+        {
+            "benchmark": "admission",
+            "concurrency": concurrency,
+            "batching": controller.INFERENCE_BATCHING_ENABLED,
+            "requests_per_second": round(num_requests / elapsed, 1),
+        }
+    )
+    return result
+
+
+async def benchmark_training_trigger(controller, nw, num_runs, num_deployments):
+    await controller.main()
+    bucket = await nw.get_bucket("model-training-parameters")
+    durations = []
+    for run in range(num_runs):
+        # Every run has new deployments, so training is always necessary.
+        workload_parameters = {
+            "uuid": str(run),
+            "workloads": generate_workloads(num_deployments, run),
+        }
+        training_job = nw.wait_for_publish("gpu_service_training_internal")
+        start_time = time.perf_counter()
+        # The controller watches the bucket and triggers training on the new parameters.
+        await bucket.put(
+            "modelTrainingParameters", json.dumps(workload_parameters).encode()
+        )
+        training_job_payload = json.loads(await training_job)
+        durations.append(time.perf_counter() - start_time)
+        # Complete the job so the next run is not rejected as a training is in progress.
+        job_end_payload = {"status": "JobEnd", "job_id": training_job_payload["job_id"]}
+        await nw.deliver("gpu_trainingjob_status", json.dumps(job_end_payload).encode())
+    result = latency_summary(durations[1:] or durations)
+    result.update(
+        {
+            "benchmark": "training_trigger",
+            "deployments": num_deployments,
+            # The first run computes the training budget, later runs use the cached one.
+            "first_run_ms": round(durations[0] * 1000, 3),
+        }
+    )
+    return result
+
+
+async def benchmark_sampling_plan(num_logs, num_intervals, page_size):
+    # Third Party
+    from sampling_planner import SamplingPlanner
+
+    es = FakeAsyncElasticsearch(num_logs=num_logs)
+    es.get_corpus()
+    interval_size = num_logs // num_intervals
+    intervals = [
+        {
+            "start_ts": CORPUS_START_TS + idx * interval_size,
+            "end_ts": CORPUS_START_TS + (idx + 1) * interval_size,
+        }
+        for idx in range(num_intervals)
+    ]
+    planner = SamplingPlanner(stratified=True, page_size=page_size)
+    start_time = time.perf_counter()
+    plan = await planner.plan(es, intervals, num_logs // 2)
+    elapsed = time.perf_counter() - start_time
+    return {
+        "benchmark": "sampling_plan",
+        "logs": num_logs,
+        "intervals": num_intervals,
+        "seconds": round(elapsed, 3),
+        "planned_logs": sum(plan.num_logs_per_interval.values()),
+        "workload_quotas": sum(len(quotas) for quotas in plan.workload_quotas.values()),
+    }
+
+
+async def benchmark_export(num_logs, output_format, workers, page_size):
+    # Third Party
+    from training_data_exporter import TrainingDataExporter
+
+    es = FakeAsyncElasticsearch(num_logs=num_logs)
+    # The projected training fields are what the exporter reads out of Elasticsearch.
+    source_mib = (
+        sum(
+            len(json.dumps({field: hit["_source"][field] for field in TRAINING_FIELDS}))
+            for hit in es.get_corpus()
+        )
+        / 2**20
+    )
+    if output_format == "parquet":
+        # Keep the one-off import of pyarrow out of the timing.
+        # Third Party
+        import pyarrow.parquet  # noqa: F401
+    with tempfile.TemporaryDirectory(dir=WORKING_DIR) as output_dir:
+        exporter = TrainingDataExporter(
+            es,
+            output_dir,
+            workers=workers,
+            page_size=page_size,
+            output_format=output_format,
+        )
+        interval = {
+            "start_ts": CORPUS_START_TS,
+            "end_ts": CORPUS_START_TS + num_logs,
+            "filename": f"{CORPUS_START_TS}_{CORPUS_START_TS + num_logs}.json",
+        }
+        start_time = time.perf_counter()
+        exported_files = await exporter.export([interval], {0: num_logs})
+        elapsed = time.perf_counter() - start_time
+        output_mib = (
+            sum(
+                os.path.getsize(os.path.join(output_dir, exported_file))
+                for exported_file in exported_files
+            )
+            / 2**20
+        )
+    return {
+        "benchmark": "export",
+        "logs": num_logs,
+        "output_format": output_format,
+        "workers": workers,
+        "seconds": round(elapsed, 3),
+        "logs_per_second": round(num_logs / elapsed, 1),
+        "source_mib": round(source_mib, 2),
+        "source_mib_per_second": round(source_mib / elapsed, 2),
+        "output_mib": round(output_mib, 2),
+    }
+
+
+async def startup_probe():
+    # Start the controller as main.py does and answer one admission request. The NATS client
+    # is already imported by the fakes, so the import time covers the controller modules only.
+    import_start_time = time.perf_counter()
+    nw = FakeNatsWrapper()
+
+    async def gpu_service_running(payload):
+        return b"running"
+
+    nw.add_responder("gpu_service_running", gpu_service_running)
+    controller = load_controller(
+        nw,
+        FakeAsyncElasticsearch(num_logs=0),
+        FakeS3Resource(),
+        FakeOpniInternalClient(),
+    )
+    import_seconds = time.perf_counter() - import_start_time
+    await controller.init_nats()
+    await controller.consume_request()
+    reply = nw.wait_for_publish("_INBOX.startup")
+    await nw.deliver("gpu_service_inference", b"{}", reply="_INBOX.startup")
+    await reply
+    print(json.dumps({"import_seconds": import_seconds, "replied_at": time.time()}))
+
+
+def benchmark_startup(num_runs):
+    startup_seconds = []
+    import_seconds = []
+    for _ in range(num_runs):
+        start_time = time.time()
+        probe = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--startup-probe"],
+            check=True,
+            capture_output=True,
+            text=True,
+        )
+        probe_result = json.loads(probe.stdout.strip().splitlines()[-1])
+        startup_seconds.append(probe_result["replied_at"] - start_time)
+        import_seconds.append(probe_result["import_seconds"])
+    result = latency_summary(startup_seconds)
+    result.update(
+        {
+            "benchmark": "startup",
+            "controller_import_p50_ms": round(
+                percentile(import_seconds, 0.5) * 1000, 3
+            ),
+        }
+    )
+    return result
+
+
+async def run_benchmarks(args):
+    nw = FakeNatsWrapper()
+    es = FakeAsyncElasticsearch(num_logs=args.sample_logs, latency=args.es_latency)
+    es.get_corpus()
+
+    async def gpu_service_running(payload):
+        return b"running"
+
+    nw.add_responder("gpu_service_running", gpu_service_running)
+    controller = load_controller(nw, es, FakeS3Resource(), FakeOpniInternalClient())
+    logging.getLogger().setLevel(args.log_level)
+
+    results = [
+        benchmark_startup(args.startup_runs),
+        await benchmark_admission(
+            controller, nw, args.admission_requests, args.admission_concurrency
+        ),
+        await benchmark_training_trigger(
+            controller, nw, args.trigger_runs, args.deployments
+        ),
+    ]
+    for num_logs in args.sizes:
+        results.append(
+            await benchmark_sampling_plan(
+                num_logs, args.sampling_intervals, args.sampling_page_size
+            )
+        )
+        for output_format in args.formats:
+            results.append(
+                await benchmark_export(
+                    num_logs, output_format, args.export_workers, args.page_size
+                )
+            )
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000])
+    parser.add_argument("--formats", nargs="+", default=["json", "parquet"])
+    parser.add_argument("--admission-requests", type=int, default=10000)
+    parser.add_argument("--admission-concurrency", type=int, default=100)
+    parser.add_argument("--trigger-runs", type=int, default=20)
+    parser.add_argument("--deployments", type=int, default=1000)
+    parser.add_argument("--sample-logs", type=int, default=10000)
+    parser.add_argument("--sampling-intervals", type=int, default=10)
+    parser.add_argument("--sampling-page-size", type=int, default=1000)
+    parser.add_argument("--export-workers", type=int, default=4)
+    parser.add_argument("--page-size", type=int, default=10000)
+    # unit: seconds. Latency added to every Elasticsearch request.
+    parser.add_argument("--es-latency", type=float, default=0)
+    parser.add_argument("--log-level", default="WARNING")
+    parser.add_argument("--startup-runs", type=int, default=5)
+    parser.add_argument("--startup-probe", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--output", help="write the results to this file")
+    args = parser.parse_args()
+
+    loop = asyncio.get_event_loop()
+    if args.startup_probe:
+        logging.getLogger().setLevel(args.log_level)
+        try:
+            loop.run_until_complete(startup_probe())
+        finally:
+            shutil.rmtree(WORKING_DIR, ignore_errors=True)
+        return
+    try:
+        results = loop.run_until_complete(run_benchmarks(args))
+    finally:
+        shutil.rmtree(WORKING_DIR, ignore_errors=True)
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as output_file:
+            output_file.write(output + "\n")
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
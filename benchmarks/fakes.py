@@ -0,0 +1,545 @@
+"""
+In-process stand-ins for NATS, Elasticsearch, S3 and the opni-internal gateway, used by the
+offline benchmarks. They implement only the calls made by the training controller and answer
+them from memory, so the benchmarks measure the controller rather than the network.
+"""
+# Standard Library
+import asyncio
+import itertools
+import random
+from collections import defaultdict
+
+# Third Party
+from nats.js.errors import KeyNotFoundError, KeyWrongLastSequenceError
+from opni_nats import NatsKeyValueWrapper
+
+LOG_TEMPLATES = [
+    "GET /api/v1/namespaces/<*>/pods 200 <num>ms",
+    "Connection to <ip> closed by remote host",
+    "Reconciling deployment <*> in namespace <*>",
+    "Pulling image <*> for container <*>",
+    "Readiness probe failed: HTTP probe failed with statuscode: <num>",
+    "Successfully assigned <*> to <*>",
+]
+# unit: ms.
+CORPUS_START_TS = 1650000000000
+# Deployments of the synthetic logs, laid out 10 per namespace and 10 namespaces per cluster.
+CORPUS_DEPLOYMENTS = 1000
+NAMESPACES_PER_CLUSTER = 10
+DEPLOYMENTS_PER_NAMESPACE = 10
+
+
+def synthetic_workload(deployment_idx):
+    # Return the (cluster_id, namespace_name, deployment_name) of a deployment index.
+    return (
+        f"cluster-{deployment_idx // (NAMESPACES_PER_CLUSTER * DEPLOYMENTS_PER_NAMESPACE)}",
+        f"namespace-{(deployment_idx // DEPLOYMENTS_PER_NAMESPACE) % NAMESPACES_PER_CLUSTER}",
+        f"deployment-{deployment_idx}",
+    )
+
+
+def synthetic_log(idx, rng, log_size=200):
+    timestamp = CORPUS_START_TS + idx
+    cluster_id, namespace_name, deployment_name = synthetic_workload(
+        rng.randrange(CORPUS_DEPLOYMENTS)
+    )
+    return {
+        "timestamp": timestamp,
+        "time": timestamp,
+        "window_start_time_ns": (timestamp // 60000) * 60000 * 1000000,
+        "masked_log": rng.choice(LOG_TEMPLATES),
+        "is_control_plane_log": False,
+        "drain_error_keyword": False,
+        "cluster_id": cluster_id,
+        "namespace_name": namespace_name,
+        "deployment": deployment_name,
+        "log": "x" * rng.randint(log_size // 2, log_size * 3 // 2),
+    }
+
+
+def synthetic_hit(idx, rng, log_size=200):
+    # A search hit, which is also the line format written by Elasticdump.
+    source = synthetic_log(idx, rng, log_size)
+    return {
+        "_index": "logs",
+        "_type": "_doc",
+        "_id": str(idx),
+        "_score": None,
+        "_source": source,
+        "sort": [source["timestamp"], idx],
+    }
+
+
+def source_value(source, field):
+    # Keyword sub-fields hold the value of their parent field.
+    return source.get(
+        field[: -len(".keyword")] if field.endswith(".keyword") else field
+    )
+
+
+def source_tokens(source, field):
+    return str(source_value(source, field) or "").lower().split()
+
+
+def as_list(clauses):
+    return clauses if isinstance(clauses, list) else [clauses]
+
+
+def compile_query(query):
+    """
+    Compile the subset of the query DSL used by the controller into a predicate on _source:
+    bool, term, terms, range, match, query_string, exists and match_all. Terms are matched
+    exactly and match queries on whitespace tokens, which is enough to count and filter the
+    synthetic corpus.
+    """
+    query_type, clause = next(iter(query.items()))
+    if query_type == "match_all":
+        return lambda source: True
+    if query_type == "bool":
+        required = [
+            compile_query(sub_query)
+            for occur in ("filter", "must")
+            for sub_query in as_list(clause.get(occur, []))
+        ]
+        excluded = [
+            compile_query(sub_query)
+            for sub_query in as_list(clause.get("must_not", []))
+        ]
+        optional = [
+            compile_query(sub_query) for sub_query in as_list(clause.get("should", []))
+        ]
+        minimum_should_match = clause.get(
+            "minimum_should_match", 0 if required else min(1, len(optional))
+        )
+        return lambda source: (
+            all(predicate(source) for predicate in required)
+            and not any(predicate(source) for predicate in excluded)
+            and (
+                minimum_should_match == 0
+                or any(predicate(source) for predicate in optional)
+            )
+        )
+    if query_type == "term":
+        field, value = next(iter(clause.items()))
+        value = value["value"] if isinstance(value, dict) else value
+        return lambda source: source_value(source, field) == value
+    if query_type == "terms":
+        field, values = next(iter(clause.items()))
+        values = frozenset(values)
+        return lambda source: source_value(source, field) in values
+    if query_type == "range":
+        field, bounds = next(iter(clause.items()))
+        comparisons = {
+            "gte": lambda value, bound: value >= bound,
+            "gt": lambda value, bound: value > bound,
+            "lte": lambda value, bound: value <= bound,
+            "lt": lambda value, bound: value < bound,
+        }
+        checks = [
+            (comparisons[op], bound)
+            for op, bound in bounds.items()
+            if op in comparisons
+        ]
+        return lambda source: source_value(source, field) is not None and all(
+            compare(source_value(source, field), bound) for compare, bound in checks
+        )
+    if query_type == "exists":
+        return lambda source: source_value(source, clause["field"]) is not None
+    if query_type == "match":
+        field, value = next(iter(clause.items()))
+        if isinstance(value, dict):
+            value = value["query"]
+        if isinstance(value, bool):
+            return lambda source: source_value(source, field) == value
+        tokens = frozenset(str(value).lower().split())
+        return lambda source: not tokens.isdisjoint(source_tokens(source, field))
+    if query_type == "query_string":
+        fields = clause.get("fields", [clause.get("default_field", "log")])
+        if " AND " in clause["query"]:
+            # Every term must be one of the values of the fields.
+            terms = clause["query"].split(" AND ")
+            return lambda source: all(
+                any(source_value(source, field) == term for field in fields)
+                for term in terms
+            )
+        terms = frozenset(
+            term.strip("() ").lower() for term in clause["query"].split(" or ")
+        )
+        return lambda source: any(
+            not terms.isdisjoint(source_tokens(source, field)) for field in fields
+        )
+    raise ValueError(f"Unsupported query type: {query_type}")
+
+
+def composite_sort_key(key):
+    # Missing values sort first, as in ascending composite aggregations.
+    return tuple((value is not None, value) for value in key)
+
+
+def composite_aggregation(hits, composite):
+    # Answer a composite aggregation of terms sources over hits, one page after composite["after"].
+    sources = [next(iter(source.items())) for source in composite["sources"]]
+    counts = dict()
+    for hit in hits:
+        key = tuple(
+            source_value(hit["_source"], terms["terms"]["field"])
+            for _, terms in sources
+        )
+        if any(
+            value is None and not terms["terms"].get("missing_bucket", False)
+            for value, (_, terms) in zip(key, sources)
+        ):
+            continue
+        counts[key] = counts.get(key, 0) + 1
+    keys = sorted(counts, key=composite_sort_key)
+    if "after" in composite:
+        after = composite_sort_key(
+            tuple(composite["after"][name] for name, _ in sources)
+        )
+        keys = [key for key in keys if composite_sort_key(key) > after]
+    buckets = [
+        {
+            "key": {name: value for (name, _), value in zip(sources, key)},
+            "doc_count": counts[key],
+        }
+        for key in keys[: composite.get("size", 10)]
+    ]
+    aggregation = {"buckets": buckets}
+    if buckets:
+        aggregation["after_key"] = buckets[-1]["key"]
+    return aggregation
+
+
+class FakeMsg:
+    def __init__(self, subject, data, reply=""):
+        self.subject = subject
+        self.data = data
+        self.reply = reply
+
+
+class FakeEntry:
+    def __init__(self, key, value, revision, operation=None):
+        self.key = key
+        self.value = value
+        self.revision = revision
+        self.operation = operation
+
+
+class FakeKeyWatcher:
+    def __init__(self):
+        self.updates = asyncio.Queue()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        return await self.updates.get()
+
+
+class FakeKeyValue:
+    """
+    Key value bucket with the interface of nats.js.kv.KeyValue used through
+    NatsKeyValueWrapper.
+    """
+
+    def __init__(self):
+        self.entries = dict()
+        self.revision = itertools.count(1)
+        self.watchers = defaultdict(list)
+
+    def notify(self, entry):
+        for watcher in self.watchers.get(entry.key, []):
+            watcher.updates.put_nowait(entry)
+
+    async def get(self, key, revision=None):
+        if key not in self.entries:
+            raise KeyNotFoundError()
+        return self.entries[key]
+
+    async def put(self, key, value):
+        entry = FakeEntry(key, value, next(self.revision))
+        self.entries[key] = entry
+        self.notify(entry)
+        return entry.revision
+
+    async def create(self, key, value):
+        return await self.update(key, value, last=0)
+
+    async def update(self, key, value, last=None):
+        current_revision = self.entries[key].revision if key in self.entries else 0
+        if last is not None and last != current_revision:
+            raise KeyWrongLastSequenceError()
+        return await self.put(key, value)
+
+    async def delete(self, key, last=None):
+        if self.entries.pop(key, None) is not None:
+            self.notify(FakeEntry(key, None, next(self.revision), "DEL"))
+
+    async def watch(self, key):
+        # The current value is delivered first, followed by None as in nats.js.kv.
+        watcher = FakeKeyWatcher()
+        if key in self.entries:
+            watcher.updates.put_nowait(self.entries[key])
+        watcher.updates.put_nowait(None)
+        self.watchers[key].append(watcher)
+        return watcher
+
+
+class FakeNatsWrapper:
+    """
+    NatsWrapper which delivers published messages to the handlers subscribed in this process.
+    Every delivery runs as its own task, like the callbacks of the NATS client. Requests are
+    answered by the responders registered with add_responder.
+    """
+
+    def __init__(self):
+        self.handlers = defaultdict(list)
+        self.responders = dict()
+        self.buckets = dict()
+        self.published = defaultdict(int)
+        self.waiters = defaultdict(list)
+
+    async def connect(self):
+        pass
+
+    async def close(self):
+        pass
+
+    async def get_bucket(self, bucket):
+        if bucket not in self.buckets:
+            self.buckets[bucket] = NatsKeyValueWrapper(bucket, FakeKeyValue())
+        return self.buckets[bucket]
+
+    async def create_bucket(self, bucket):
+        return await self.get_bucket(bucket)
+
+    async def subscribe(
+        self, nats_subject, payload_queue=None, nats_queue="", subscribe_handler=None
+    ):
+        self.handlers[nats_subject].append(subscribe_handler)
+
+    async def publish(self, nats_subject, payload):
+        self.published[nats_subject] += 1
+        for waiter in self.waiters.pop(nats_subject, []):
+            if not waiter.done():
+                waiter.set_result(payload)
+        for handler in self.handlers.get(nats_subject, []):
+            asyncio.ensure_future(handler(FakeMsg(nats_subject, payload)))
+
+    def add_responder(self, nats_subject, respond):
+        self.responders[nats_subject] = respond
+
+    async def request(self, nats_subject, payload, timeout=1):
+        if nats_subject not in self.responders:
+            raise asyncio.TimeoutError(f"no responders for {nats_subject}")
+        return FakeMsg(nats_subject, await self.responders[nats_subject](payload))
+
+    def wait_for_publish(self, nats_subject):
+        # Return a future resolved with the payload of the next message on nats_subject.
+        waiter = asyncio.get_event_loop().create_future()
+        self.waiters[nats_subject].append(waiter)
+        return waiter
+
+    async def deliver(self, nats_subject, payload, reply=""):
+        # Run the subscribed handlers of nats_subject inline and wait for them to complete.
+        msg = FakeMsg(nats_subject, payload, reply)
+        for handler in self.handlers.get(nats_subject, []):
+            await handler(msg)
+
+
+class FakeIndices:
+    def __init__(self, es):
+        self.es = es
+
+    async def stats(self, index=None, metric=None):
+        return {
+            "_all": {
+                "primaries": {
+                    "docs": {"count": self.es.num_logs},
+                    "store": {"size_in_bytes": self.es.num_logs * self.es.log_size},
+                }
+            }
+        }
+
+
+class FakeAsyncElasticsearch:
+    """
+    AsyncElasticsearch serving a synthetic logs corpus of num_logs documents. Counts, point in
+    time searches and msearch evaluate their query over the corpus with compile_query. Point in
+    time searches honor slice and search_after, so the corpus is exported exactly once however it
+    is sliced, and msearch answers the composite aggregations of the sampling planner. The corpus
+    is generated once by get_corpus, which benchmarks call before timing.
+    """
+
+    def __init__(self, num_logs=100000, log_size=200, latency=0, seed=0):
+        self.num_logs = num_logs
+        self.log_size = log_size
+        self.latency = latency
+        self.seed = seed
+        self.indices = FakeIndices(self)
+        self.pit_ids = itertools.count()
+        self.corpus = None
+
+    async def simulate_latency(self):
+        await asyncio.sleep(self.latency)
+
+    def get_corpus(self):
+        if self.corpus is None:
+            rng = random.Random(self.seed)
+            self.corpus = [
+                synthetic_hit(idx, rng, self.log_size) for idx in range(self.num_logs)
+            ]
+        return self.corpus
+
+    def matching_hits(self, query):
+        predicate = compile_query(query)
+        return [hit for hit in self.get_corpus() if predicate(hit["_source"])]
+
+    def aggregate(self, body):
+        # Answer a size-0 search made of composite aggregations.
+        hits = self.matching_hits(body.get("query", {"match_all": {}}))
+        aggregations = dict()
+        for name, aggregation in body.get("aggs", dict()).items():
+            if "composite" not in aggregation:
+                raise ValueError(f"Unsupported aggregation: {aggregation}")
+            aggregations[name] = composite_aggregation(hits, aggregation["composite"])
+        return {
+            "hits": {"total": {"value": len(hits), "relation": "eq"}, "hits": []},
+            "aggregations": aggregations,
+        }
+
+    async def count(self, index=None, body=None):
+        await self.simulate_latency()
+        if body is None or "query" not in body:
+            return {"count": self.num_logs}
+        return {"count": len(self.matching_hits(body["query"]))}
+
+    async def open_point_in_time(self, index=None, keep_alive=None):
+        await self.simulate_latency()
+        return {"id": f"pit-{next(self.pit_ids)}"}
+
+    async def close_point_in_time(self, body=None):
+        await self.simulate_latency()
+        return {"succeeded": True}
+
+    async def search(self, index=None, body=None, size=10, **kwargs):
+        await self.simulate_latency()
+        body = body or dict()
+        size = body.get("size", size)
+        if "aggs" in body:
+            return {
+                "hits": {"hits": []},
+                "aggregations": {
+                    "min_ts": {"value": CORPUS_START_TS},
+                    "max_ts": {"value": CORPUS_START_TS + self.num_logs},
+                },
+            }
+        if "pit" not in body:
+            # Latest logs first, as requested by the log size sampling.
+            hits = self.get_corpus()[::-1][:size]
+            return {"hits": {"hits": hits}}
+        # Slice i holds the documents whose position is i modulo the number of slices.
+        slice_id, num_slices = 0, 1
+        if "slice" in body:
+            slice_id, num_slices = body["slice"]["id"], body["slice"]["max"]
+        if "search_after" in body:
+            start_idx = body["search_after"][1] + num_slices
+        else:
+            start_idx = slice_id
+        corpus = self.get_corpus()
+        predicate = compile_query(body.get("query", {"match_all": {}}))
+        hits = list(
+            itertools.islice(
+                (
+                    corpus[idx]
+                    for idx in range(start_idx, self.num_logs, num_slices)
+                    if predicate(corpus[idx]["_source"])
+                ),
+                size,
+            )
+        )
+        return {"pit_id": body["pit"]["id"], "hits": {"hits": hits}}
+
+    async def msearch(self, body=None, index=None, **kwargs):
+        # Every header line is followed by a search, answered in turn like an _msearch.
+        await self.simulate_latency()
+        responses = []
+        for search_body in body[1::2]:
+            try:
+                responses.append(dict(self.aggregate(search_body), status=200))
+            except ValueError as e:
+                responses.append(
+                    {"error": {"type": "illegal_argument_exception", "reason": str(e)}}
+                )
+        return {"responses": responses}
+
+    async def bulk(self, body=None, **kwargs):
+        await self.simulate_latency()
+        items = [
+            {op_type: {"_id": metadata["_id"], "status": 200}}
+            for line in body
+            for op_type, metadata in line.items()
+            if op_type in ("index", "create", "update", "delete")
+        ]
+        return {"errors": False, "items": items}
+
+    async def update(self, index=None, doc_type=None, id=None, body=None):
+        await self.simulate_latency()
+
+    async def delete(self, index=None, doc_type=None, id=None):
+        await self.simulate_latency()
+
+    async def close(self):
+        pass
+
+
+class FakeS3Client:
+    def __init__(self, objects):
+        self.objects = objects
+
+    def head_object(self, Bucket, Key):
+        # Third Party
+        from botocore.exceptions import ClientError
+
+        if (Bucket, Key) not in self.objects:
+            raise ClientError({"Error": {"Code": "404"}}, "HeadObject")
+        return {"ETag": f'"{hash(self.objects[(Bucket, Key)])}"'}
+
+    def put_object(self, Bucket, Key, Body=b""):
+        self.objects[(Bucket, Key)] = Body
+        return {"ETag": f'"{hash(Body)}"'}
+
+
+class FakeS3Meta:
+    def __init__(self, client):
+        self.client = client
+
+
+class FakeS3Resource:
+    """
+    The part of the boto3 S3 resource used by the controller, backed by a dict.
+    """
+
+    def __init__(self):
+        self.objects = dict()
+        self.meta = FakeS3Meta(FakeS3Client(self.objects))
+
+
+class FakeOpniInternalClient:
+    """
+    OpniInternalClient which reports num_gpus allocatable GPUs and accepts every update.
+    """
+
+    def __init__(self, num_gpus=1):
+        self.num_gpus = num_gpus
+        self.puts = []
+
+    async def get_json(self, url, timeout=None):
+        return {"items": [{"allocatable": str(self.num_gpus)}]}
+
+    async def put_json(self, url, payload, timeout=None):
+        self.puts.append(payload)
+        return 200
+
+    async def close(self):
+        pass
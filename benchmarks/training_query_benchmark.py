@@ -0,0 +1,170 @@
+"""
+Compare the compiled training query with the previous one query_string clause per deployment.
+Reports build and serialization time, body size and count latency for several workload set
+sizes. The counts run against ES_ENDPOINT when it points at a local Elasticsearch, otherwise
+against the synthetic corpus of FakeAsyncElasticsearch, which evaluates both queries in process.
+
+    python benchmarks/training_query_benchmark.py --deployments 100 1000 5000
+"""
+# Standard Library
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(
+    0,
+    os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), "..", "training_controller"
+    ),
+)
+
+# Third Party
+from fakes import (  # noqa: E402
+    CORPUS_START_TS,
+    FakeAsyncElasticsearch,
+    synthetic_workload,
+)
+from training_query import TrainingQueryCompiler  # noqa: E402
+from workload_fingerprint import WorkloadTree  # noqa: E402
+
+ANOMALY_KEYWORDS = ["error", "fail", "fatal", "exception", "timeout", "crash"]
+
+
+def generate_workloads(num_deployments):
+    # The same deployments as the logs of the synthetic corpus.
+    workloads = dict()
+    for idx in range(num_deployments):
+        cluster_id, namespace_name, deployment_name = synthetic_workload(idx)
+        workloads.setdefault(cluster_id, dict()).setdefault(namespace_name, []).append(
+            deployment_name
+        )
+    return workloads
+
+
+def legacy_query(workloads, start_ts, end_ts):
+    # The query built by train_model before the query compiler was introduced.
+    parentheses_keywords = [f"({x})" for x in ANOMALY_KEYWORDS]
+    query_body = {
+        "query": {
+            "bool": {
+                "filter": [{"range": {"time": {"gte": start_ts, "lte": end_ts}}}],
+                "minimum_should_match": 1,
+                "should": [],
+                "must_not": [
+                    {"match": {"anomaly_level.keyword": "Anomaly"}},
+                    {
+                        "query_string": {
+                            "query": " or ".join(parentheses_keywords),
+                            "default_field": "log",
+                        }
+                    },
+                ],
+            },
+        }
+    }
+    for cluster_id in workloads:
+        for namespace_name in workloads[cluster_id]:
+            for deployment_name in workloads[cluster_id][namespace_name]:
+                query_body["query"]["bool"]["should"].append(
+                    {
+                        "query_string": {
+                            "fields": [
+                                "cluster_id",
+                                "namespace_name.keyword",
+                                "deployment.keyword",
+                            ],
+                            "query": f"{cluster_id} AND {namespace_name} AND {deployment_name}",
+                        }
+                    }
+                )
+    return query_body
+
+
+def time_build(build_query, repeat):
+    timings = []
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        body = json.dumps(build_query()).encode()
+        timings.append(time.perf_counter() - start_time)
+    return statistics.median(timings) * 1000, len(body)
+
+
+async def time_count(es_instance, query_body, repeat):
+    timings = []
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        count = (await es_instance.count(index="logs", body=query_body))["count"]
+        timings.append(time.perf_counter() - start_time)
+    return statistics.median(timings) * 1000, count
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--deployments", type=int, nargs="+", default=[100, 1000, 5000])
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--count-repeat", type=int, default=3)
+    parser.add_argument(
+        "--num-logs",
+        type=int,
+        default=2000,
+        help="Size of the synthetic corpus when ES_ENDPOINT is not set",
+    )
+    args = parser.parse_args()
+
+    if "ES_ENDPOINT" in os.environ:
+        # Third Party
+        from elasticsearch import AsyncElasticsearch
+
+        es_instance = AsyncElasticsearch(
+            [os.environ["ES_ENDPOINT"]],
+            http_auth=(
+                os.getenv("ES_USERNAME", "admin"),
+                os.getenv("ES_PASSWORD", "admin"),
+            ),
+            verify_certs=False,
+        )
+        end_ts = int(time.time() * 1000)
+        start_ts = end_ts - 3600 * 1000
+    else:
+        es_instance = FakeAsyncElasticsearch(num_logs=args.num_logs)
+        es_instance.get_corpus()
+        start_ts, end_ts = CORPUS_START_TS, CORPUS_START_TS + args.num_logs
+    results = []
+    for num_deployments in args.deployments:
+        workloads = generate_workloads(num_deployments)
+        # train_model passes the root digest computed when the workloads were compared.
+        workloads_key = WorkloadTree(workloads).root_digest
+        compiler = TrainingQueryCompiler(ANOMALY_KEYWORDS)
+        queries = {
+            "legacy": lambda: legacy_query(workloads, start_ts, end_ts),
+            "compiled_cold": lambda: TrainingQueryCompiler(ANOMALY_KEYWORDS).compile(
+                workloads, start_ts, end_ts
+            ),
+            "compiled_cached": lambda: compiler.compile(
+                workloads, start_ts, end_ts, workloads_key
+            ),
+        }
+        for name, build_query in queries.items():
+            build_ms, body_bytes = time_build(build_query, args.repeat)
+            result = {
+                "benchmark": name,
+                "deployments": num_deployments,
+                "build_and_serialize_ms": round(build_ms, 3),
+                "body_bytes": body_bytes,
+            }
+            count_ms, count = await time_count(
+                es_instance, build_query(), args.count_repeat
+            )
+            result["count_ms"] = round(count_ms, 3)
+            result["count"] = count
+            results.append(result)
+    await es_instance.close()
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,67 @@
+# Standard Library
+import os
+
+# Clients of the external services, created on first use. Importing elasticsearch, boto3 and
+# aiohttp is the bulk of the startup time, so nothing is imported until a client is needed.
+# The set_* functions inject another client, they are called before the controller is imported.
+es_instance = None
+s3_resource = None
+nats_wrapper = None
+
+
+def get_es_instance():
+    global es_instance
+    if es_instance is None:
+        # Third Party
+        from elasticsearch import AsyncElasticsearch
+
+        es_instance = AsyncElasticsearch(
+            [os.environ["ES_ENDPOINT"]],
+            port=9200,
+            http_auth=(os.environ["ES_USERNAME"], os.environ["ES_PASSWORD"]),
+            verify_certs=False,
+            use_ssl=True,
+        )
+    return es_instance
+
+
+def set_es_instance(instance):
+    global es_instance
+    es_instance = instance
+
+
+def get_s3_resource():
+    global s3_resource
+    if s3_resource is None:
+        # Third Party
+        import boto3
+        from botocore.client import Config
+
+        s3_resource = boto3.resource(
+            "s3",
+            endpoint_url=os.environ["S3_ENDPOINT"],
+            aws_access_key_id=os.environ["S3_ACCESS_KEY"],
+            aws_secret_access_key=os.environ["S3_SECRET_KEY"],
+            config=Config(signature_version="s3v4"),
+        )
+    return s3_resource
+
+
+def set_s3_resource(resource):
+    global s3_resource
+    s3_resource = resource
+
+
+def get_nats_wrapper():
+    global nats_wrapper
+    if nats_wrapper is None:
+        # Third Party
+        from opni_nats import NatsWrapper
+
+        nats_wrapper = NatsWrapper()
+    return nats_wrapper
+
+
+def set_nats_wrapper(wrapper):
+    global nats_wrapper
+    nats_wrapper = wrapper
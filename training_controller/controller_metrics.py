@@ -0,0 +1,82 @@
+# Standard Library
+import asyncio
+import functools
+import logging
+import os
+import time
+
+# Third Party
+from prometheus_client import Counter, Gauge, Histogram, start_http_server
+
+METRICS_PORT = int(os.getenv("METRICS_PORT", 8000))
+# unit: seconds.
+EVENT_LOOP_LAG_INTERVAL = float(os.getenv("EVENT_LOOP_LAG_INTERVAL", 1))
+
+NATS_HANDLER_SECONDS = Histogram(
+    "training_controller_nats_handler_seconds",
+    "Time spent handling a NATS message.",
+    ["handler"],
+)
+NATS_HANDLER_ERRORS = Counter(
+    "training_controller_nats_handler_errors_total",
+    "NATS messages whose handler raised an exception.",
+    ["handler"],
+)
+ADMISSION_DECISIONS = Counter(
+    "training_controller_admission_decisions_total",
+    "Replies to gpu_service_inference admission requests.",
+    ["decision"],
+)
+ES_REQUEST_SECONDS = Histogram(
+    "training_controller_es_request_seconds",
+    "Time spent on Elasticsearch requests.",
+    ["operation"],
+)
+S3_REQUEST_SECONDS = Histogram(
+    "training_controller_s3_request_seconds",
+    "Time spent on S3 requests.",
+    ["operation"],
+)
+TRAINING_DATA_STAGE_SECONDS = Histogram(
+    "training_controller_training_data_stage_seconds",
+    "Duration of the training data preparation stages.",
+    ["stage"],
+    buckets=(1, 5, 15, 30, 60, 120, 300, 600, 1800, 3600, float("inf")),
+)
+TRAINING_DATA_BYTES_WRITTEN = Counter(
+    "training_controller_training_data_bytes_written_total",
+    "Bytes of training data files written to the training directory.",
+)
+EVENT_LOOP_LAG_SECONDS = Gauge(
+    "training_controller_event_loop_lag_seconds",
+    "Delay of the event loop in waking up a sleeping task.",
+)
+
+
+def timed_handler(handler_name):
+    # Decorate an async NATS handler to record its latency and errors.
+    def decorator(handler):
+        @functools.wraps(handler)
+        async def wrapper(msg):
+            with NATS_HANDLER_SECONDS.labels(handler_name).time():
+                try:
+                    return await handler(msg)
+                except Exception:
+                    NATS_HANDLER_ERRORS.labels(handler_name).inc()
+                    raise
+
+        return wrapper
+
+    return decorator
+
+
+async def monitor_event_loop_lag(interval=EVENT_LOOP_LAG_INTERVAL):
+    while True:
+        start_time = time.monotonic()
+        await asyncio.sleep(interval)
+        EVENT_LOOP_LAG_SECONDS.set(max(0, time.monotonic() - start_time - interval))
+
+
+def start_metrics_server(port=METRICS_PORT):
+    start_http_server(port)
+    logging.info(f"Serving metrics on port {port}")
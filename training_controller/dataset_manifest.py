@@ -0,0 +1,141 @@
+# Standard Library
+import bisect
+import copy
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+
+MANIFEST_FILE = "manifest.json"
+# Training data files are named after the window they hold: {start_ts}_{end_ts}[.suffix]
+WINDOW_FILE_PATTERN = re.compile(r"^(\d+)_(\d+)(\.|$)")
+
+
+def window_from_filename(filename):
+    # Return the (start_ts, end_ts) window of a training data file or None for other files.
+    match = WINDOW_FILE_PATTERN.match(os.path.basename(filename))
+    if match is None:
+        return None
+    return int(match.group(1)), int(match.group(2))
+
+
+def file_sha256(path):
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as data_file:
+        for block in iter(lambda: data_file.read(1 << 20), b""):
+            sha256.update(block)
+    return sha256.hexdigest()
+
+
+class DatasetManifest:
+    """
+    Persistent index of the exported training windows within the training directory.
+    Windows are keyed by (start_ts, end_ts) and record the name, byte size and checksum of each
+    of their files, with the rows written to the file and the records, i.e. the logs, they
+    represent, which differ once templates are deduplicated. Windows are kept sorted by start_ts, so exact lookups
+    and the windows starting at a timestamp do not need to scan the directory.
+    """
+
+    def __init__(self, training_dir):
+        self.training_dir = training_dir
+        self.manifest_path = os.path.join(training_dir, MANIFEST_FILE)
+        self.lock = threading.Lock()
+        self.windows = dict()
+        self.sorted_windows = []
+        self.load()
+
+    def load(self):
+        if os.path.exists(self.manifest_path):
+            try:
+                with open(self.manifest_path) as manifest_file:
+                    manifest = json.load(manifest_file)
+                for window_entry in manifest["windows"]:
+                    window = (window_entry["start_ts"], window_entry["end_ts"])
+                    self.windows[window] = window_entry["files"]
+                self.sorted_windows = sorted(self.windows)
+                return
+            except Exception as e:
+                logging.warning(f"Rebuilding unreadable dataset manifest, error: {e}")
+        self.rebuild()
+
+    def rebuild(self):
+        # Index the files already present within the training directory.
+        self.windows = dict()
+        self.sorted_windows = []
+        if not os.path.exists(self.training_dir):
+            return
+        for filename in os.listdir(self.training_dir):
+            if filename.endswith(".tmp") or window_from_filename(filename) is None:
+                continue
+            self.add_file(os.path.join(self.training_dir, filename))
+        logging.info(f"Indexed {len(self.windows)} training windows")
+        self.save()
+
+    def save(self):
+        # The file entries are copied under the lock, as exporter threads may add files meanwhile.
+        with self.lock:
+            manifest = {
+                "windows": [
+                    {
+                        "start_ts": start_ts,
+                        "end_ts": end_ts,
+                        "files": copy.deepcopy(self.windows[(start_ts, end_ts)]),
+                    }
+                    for start_ts, end_ts in self.sorted_windows
+                ]
+            }
+        if not os.path.exists(self.training_dir):
+            os.makedirs(self.training_dir)
+        tmp_manifest_path = f"{self.manifest_path}.tmp"
+        with open(tmp_manifest_path, "w") as manifest_file:
+            json.dump(manifest, manifest_file)
+        os.replace(tmp_manifest_path, self.manifest_path)
+
+    def add_file(self, path, num_rows=None, num_records=None):
+        window = window_from_filename(path)
+        if window is None:
+            raise ValueError(f"{path} is not named after a training window")
+        file_entry = {
+            "rows": num_rows,
+            "records": num_records if num_records is not None else num_rows,
+            "bytes": os.path.getsize(path),
+            "sha256": file_sha256(path),
+        }
+        with self.lock:
+            if window not in self.windows:
+                self.windows[window] = dict()
+                bisect.insort(self.sorted_windows, window)
+            self.windows[window][os.path.basename(path)] = file_entry
+
+    def remove_files(self, filenames):
+        with self.lock:
+            for filename in filenames:
+                window = window_from_filename(filename)
+                if window not in self.windows:
+                    continue
+                self.windows[window].pop(filename, None)
+                if len(self.windows[window]) == 0:
+                    del self.windows[window]
+                    self.sorted_windows.remove(window)
+
+    def files(self, start_ts, end_ts):
+        # Return the names of the files holding exactly the window (start_ts, end_ts).
+        return list(self.windows.get((start_ts, end_ts), dict()))
+
+    def files_starting_at(self, start_ts):
+        # Return the names of the files of every window beginning at start_ts.
+        idx = bisect.bisect_left(self.sorted_windows, (start_ts, -1))
+        filenames = []
+        while (
+            idx < len(self.sorted_windows) and self.sorted_windows[idx][0] == start_ts
+        ):
+            filenames.extend(self.windows[self.sorted_windows[idx]])
+            idx += 1
+        return filenames
+
+    def file_entries(self):
+        # Yield (filename, file entry) for every file within the manifest.
+        for window in self.sorted_windows:
+            yield from self.windows[window].items()
@@ -0,0 +1,132 @@
+# Standard Library
+import logging
+import os
+import shutil
+
+# Fraction of the free space of the training data volume which new training data may use.
+DISK_BUDGET_FRACTION = float(os.getenv("DISK_BUDGET_FRACTION", 0.8))
+# unit: bytes. Free space always left on the training data volume.
+DISK_HEADROOM_BYTES = int(os.getenv("DISK_HEADROOM_BYTES", 1 << 30))
+# Number of logs the manifest must hold before its bytes per log replace the sampled estimate.
+DISK_BUDGET_MIN_LEARNED_LOGS = int(os.getenv("DISK_BUDGET_MIN_LEARNED_LOGS", 10000))
+
+
+def volume_usage(path):
+    # Return the disk usage of the volume behind path, which may not exist yet.
+    path = os.path.abspath(path)
+    while not os.path.exists(path):
+        parent_path = os.path.dirname(path)
+        if parent_path == path:
+            break
+        path = parent_path
+    return shutil.disk_usage(path)
+
+
+def learned_log_size(manifest):
+    # Return the (number of logs, bytes) of the manifest files which recorded their records.
+    num_logs, num_bytes = 0, 0
+    for _, file_entry in manifest.file_entries():
+        # Entries written before records were recorded only hold their rows.
+        num_records = file_entry.get("records", file_entry.get("rows"))
+        if num_records:
+            num_logs += num_records
+            num_bytes += file_entry["bytes"]
+    return num_logs, num_bytes
+
+
+class DiskQuota:
+    """
+    Disk quota of one export. Logs are reserved before every page is fetched, against the quota
+    at the projected bytes per log and against the free space of the volume, so the export stops
+    once the quota is used up or the volume gets down to its headroom.
+    """
+
+    def __init__(self, training_dir, quota_bytes, bytes_per_log, headroom_bytes):
+        self.training_dir = training_dir
+        self.quota_bytes = quota_bytes
+        self.bytes_per_log = bytes_per_log or 0
+        self.headroom_bytes = headroom_bytes
+        self.used_bytes = 0
+        self.exhausted = False
+
+    def reserve(self, num_logs):
+        # Return whether num_logs more logs can be written.
+        if self.exhausted:
+            return False
+        num_bytes = num_logs * self.bytes_per_log
+        free = volume_usage(self.training_dir).free
+        if self.used_bytes + num_bytes > self.quota_bytes:
+            logging.warning(
+                f"Training data disk quota of {self.quota_bytes} bytes reached, stopping export"
+            )
+            self.exhausted = True
+        elif free - num_bytes < self.headroom_bytes:
+            logging.warning(
+                f"Training data volume down to {free} free bytes, stopping export"
+            )
+            self.exhausted = True
+        else:
+            self.used_bytes += num_bytes
+        return not self.exhausted
+
+    def release(self, num_logs):
+        # Give back the part of a reservation which was not written.
+        self.used_bytes -= num_logs * self.bytes_per_log
+
+
+class DiskBudget:
+    """
+    Budget of new training data on the volume behind the training directory.
+    The quota is a fraction of the free space of that volume, less a fixed headroom. The size of
+    a log is learned from the records and bytes of the files in the dataset manifest, i.e. what
+    was actually written once projected and compressed, and the sampled size of a log in
+    Elasticsearch is only used until the manifest holds min_learned_logs logs.
+    """
+
+    def __init__(
+        self,
+        training_dir,
+        manifest=None,
+        fraction=DISK_BUDGET_FRACTION,
+        headroom_bytes=DISK_HEADROOM_BYTES,
+        min_learned_logs=DISK_BUDGET_MIN_LEARNED_LOGS,
+    ):
+        self.training_dir = training_dir
+        self.manifest = manifest
+        self.fraction = fraction
+        self.headroom_bytes = headroom_bytes
+        self.min_learned_logs = min_learned_logs
+
+    def free_bytes(self):
+        return volume_usage(self.training_dir).free
+
+    def quota_bytes(self, free=None):
+        if free is None:
+            free = self.free_bytes()
+        return max(0, int(min(free * self.fraction, free - self.headroom_bytes)))
+
+    def bytes_per_log(self, sampled_bytes_per_log=None):
+        if self.manifest is not None:
+            num_logs, num_bytes = learned_log_size(self.manifest)
+            if num_logs >= self.min_learned_logs:
+                return num_bytes / num_logs
+        return sampled_bytes_per_log
+
+    def max_logs(self, sampled_bytes_per_log=None, free=None):
+        # Return the number of logs which fit in the quota, 0 if their size is unknown.
+        bytes_per_log = self.bytes_per_log(sampled_bytes_per_log)
+        if not bytes_per_log:
+            return 0
+        quota_bytes = self.quota_bytes(free)
+        logging.info(
+            f"Disk quota = {quota_bytes} bytes, projected size per log = {bytes_per_log} bytes"
+        )
+        return int(quota_bytes / bytes_per_log)
+
+    def open_quota(self, sampled_bytes_per_log=None):
+        return DiskQuota(
+            self.training_dir,
+            self.quota_bytes(),
+            self.bytes_per_log(sampled_bytes_per_log),
+            self.headroom_bytes,
+        )
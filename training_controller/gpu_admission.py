@@ -0,0 +1,94 @@
+# Standard Library
+import asyncio
+import logging
+import os
+import time
+
+# Third Party
+from single_flight import SingleFlight
+
+# unit: seconds.
+GPU_ADMISSION_REFRESH_INTERVAL = float(os.getenv("GPU_ADMISSION_REFRESH_INTERVAL", 5))
+GPU_ADMISSION_MAX_STALENESS = float(os.getenv("GPU_ADMISSION_MAX_STALENESS", 15))
+
+
+class GpuAdmissionState:
+    """
+    In-memory view of the GPU and GPU service availability used to admit inference requests.
+    The state is refreshed in the background and whenever a training job starts or ends, so
+    admission is answered from memory. Once the state is older than max_staleness, the next
+    request falls back to a live refresh which is shared by every concurrent caller.
+    """
+
+    def __init__(
+        self,
+        fetch_gpu_status,
+        fetch_gpu_service_status,
+        refresh_interval=GPU_ADMISSION_REFRESH_INTERVAL,
+        max_staleness=GPU_ADMISSION_MAX_STALENESS,
+    ):
+        self.fetch_gpu_status = fetch_gpu_status
+        self.fetch_gpu_service_status = fetch_gpu_service_status
+        self.refresh_interval = refresh_interval
+        self.max_staleness = max_staleness
+        self.gpu_status = "unavailable"
+        self.gpu_service_status = "unavailable"
+        self.updated_at = None
+        self.refresh_flight = SingleFlight(self.fetch_and_update)
+        self.refresh_task = None
+
+    def is_fresh(self):
+        return (
+            self.updated_at is not None
+            and time.monotonic() - self.updated_at <= self.max_staleness
+        )
+
+    def is_available(self):
+        return (
+            self.gpu_status == "available" and self.gpu_service_status != "unavailable"
+        )
+
+    async def fetch_and_update(self):
+        self.gpu_status, self.gpu_service_status = await asyncio.gather(
+            self.fetch_gpu_status(), self.fetch_gpu_service_status()
+        )
+        self.updated_at = time.monotonic()
+
+    async def refresh(self):
+        # Only one refresh runs at a time, callers arriving meanwhile wait for its result.
+        await self.refresh_flight.join()
+
+    def request_refresh(self):
+        # The refresh in flight may predate the change, so a new one follows it.
+        asyncio.ensure_future(self.refresh_flight.trigger())
+
+    def set_gpu_service_status(self, gpu_service_status):
+        self.gpu_service_status = gpu_service_status
+        self.updated_at = time.monotonic()
+
+    def on_training_job_status(self, message):
+        # Training jobs claim and release the GPU, so re-read its availability right away.
+        if message in ("JobStart", "JobEnd"):
+            self.request_refresh()
+
+    async def admit(self):
+        if not self.is_fresh():
+            logging.info("GPU admission state is stale, refreshing it inline")
+            try:
+                await self.refresh()
+            except Exception as e:
+                logging.error(e)
+                return False
+        return self.is_available()
+
+    async def run(self):
+        while True:
+            try:
+                await self.refresh()
+            except Exception as e:
+                logging.error(e)
+            await asyncio.sleep(self.refresh_interval)
+
+    def start(self):
+        if self.refresh_task is None or self.refresh_task.done():
+            self.refresh_task = asyncio.ensure_future(self.run())
@@ -0,0 +1,126 @@
+# Standard Library
+import json
+import logging
+import time
+import uuid
+from collections import OrderedDict
+
+GPU_JOBS_BUCKET = "model-training-parameters"
+GPU_JOBS_KEY = "gpuTrainingJobs"
+# Number of ended job ids remembered to ignore duplicated or late JobStart messages.
+ENDED_JOBS_HISTORY = 100
+
+
+def new_job_id():
+    return uuid.uuid4().hex
+
+
+class GpuJobTracker:
+    """
+    Track the GPU training jobs which are currently running, by job id.
+    Every job holds a lease which expires after lease_time seconds, so a lost JobEnd cannot
+    block inference forever. The GPU service only reports JobStart and JobEnd, so lease_time
+    must exceed the longest training run; any other status message, such as a progress report
+    or a JobHeartbeat, renews the lease. Duplicated messages are idempotent and the jobs are
+    persisted in NATS KV to survive restarts. on_job_end is called with the id of every job
+    which ends or whose lease expires.
+
+    The controller publishes the plain "JobStart" message and carries the job id in the training
+    payload only, so the jobs of the leader are started under that id before it is published.
+    Status messages without a job id or with an id unknown to this replica apply to the oldest
+    running job, and as the GPU service runs one training job at a time, a JobStart without id
+    only starts a job when none is running. JSON documents {"status": ..., "job_id": ...} are
+    accepted as well.
+    """
+
+    def __init__(self, nw, lease_time, on_job_end=None):
+        self.nw = nw
+        self.lease_time = lease_time
+        self.on_job_end = on_job_end
+        self.jobs = dict()
+        self.ended_jobs = OrderedDict()
+
+    def expire_jobs(self):
+        now = time.time()
+        for job_id, expires_at in list(self.jobs.items()):
+            if expires_at <= now:
+                logging.warning(f"Lease of GPU training job {job_id} expired")
+                self.end_job(job_id)
+
+    def active_jobs(self):
+        self.expire_jobs()
+        return list(self.jobs)
+
+    def is_training(self):
+        return len(self.active_jobs()) > 0
+
+    def start_job(self, job_id):
+        if job_id in self.ended_jobs:
+            logging.info(
+                f"Ignoring JobStart of already ended GPU training job {job_id}"
+            )
+            return
+        self.jobs[job_id] = time.time() + self.lease_time
+
+    def renew_job(self, job_id):
+        if job_id in self.jobs:
+            self.jobs[job_id] = time.time() + self.lease_time
+
+    def end_job(self, job_id):
+        if job_id in self.jobs and self.on_job_end is not None:
+            self.on_job_end(job_id)
+        self.jobs.pop(job_id, None)
+        self.ended_jobs[job_id] = time.time()
+        while len(self.ended_jobs) > ENDED_JOBS_HISTORY:
+            self.ended_jobs.popitem(last=False)
+
+    def oldest_job(self):
+        return min(self.jobs, key=self.jobs.get) if len(self.jobs) > 0 else None
+
+    def handle_status_message(self, message):
+        # Apply a gpu_trainingjob_status message and return its status.
+        try:
+            status_payload = json.loads(message)
+            status, job_id = status_payload["status"], status_payload.get("job_id")
+        except (ValueError, TypeError, KeyError):
+            status, job_id = message, None
+        if status == "JobStart":
+            if job_id is not None:
+                self.start_job(job_id)
+            elif len(self.jobs) > 0:
+                logging.info(
+                    "Ignoring duplicated JobStart of the running GPU training job"
+                )
+            else:
+                self.start_job(new_job_id())
+        else:
+            if job_id not in self.jobs and job_id not in self.ended_jobs:
+                job_id = self.oldest_job()
+            if job_id is not None and status == "JobEnd":
+                self.end_job(job_id)
+            elif job_id is not None:
+                # Progress of a running job.
+                self.renew_job(job_id)
+        return status
+
+    async def get_bucket(self):
+        return await self.nw.get_bucket(GPU_JOBS_BUCKET)
+
+    async def load(self):
+        try:
+            bucket = await self.get_bucket()
+            payload = await bucket.get(GPU_JOBS_KEY) if bucket is not None else None
+            if payload:
+                self.jobs = json.loads(payload.decode())["jobs"]
+                self.expire_jobs()
+                logging.info(f"Loaded GPU training jobs : {list(self.jobs)}")
+        except Exception as e:
+            logging.error(f"Failed to load GPU training jobs, error: {e}")
+
+    async def save(self):
+        try:
+            bucket = await self.get_bucket()
+            if bucket is not None:
+                await bucket.put(GPU_JOBS_KEY, json.dumps({"jobs": self.jobs}).encode())
+        except Exception as e:
+            logging.error(f"Failed to persist GPU training jobs, error: {e}")
@@ -0,0 +1,77 @@
+# Standard Library
+import asyncio
+import logging
+import os
+import random
+
+GPU_SERVICE_READINESS_SUBJECT = os.getenv(
+    "GPU_SERVICE_READINESS_SUBJECT", "gpu_service_heartbeat"
+)
+# unit: seconds.
+GPU_SERVICE_POLL_INITIAL_BACKOFF = float(
+    os.getenv("GPU_SERVICE_POLL_INITIAL_BACKOFF", 1)
+)
+GPU_SERVICE_POLL_MAX_BACKOFF = float(os.getenv("GPU_SERVICE_POLL_MAX_BACKOFF", 30))
+
+
+class GpuServiceReadinessWatcher:
+    """
+    Shared wait for the GPU service to be running.
+    Any number of callers await the same readiness future. It is resolved either by a heartbeat
+    from the GPU service or by a single poller which checks the status with exponential backoff
+    and jitter. The poller only runs while somebody is waiting.
+    """
+
+    def __init__(
+        self,
+        check_status,
+        on_status=None,
+        initial_backoff=GPU_SERVICE_POLL_INITIAL_BACKOFF,
+        max_backoff=GPU_SERVICE_POLL_MAX_BACKOFF,
+    ):
+        self.check_status = check_status
+        self.on_status = on_status
+        self.initial_backoff = initial_backoff
+        self.max_backoff = max_backoff
+        self.ready_future = None
+        self.poller_task = None
+        self.num_waiters = 0
+
+    def mark_ready(self):
+        if self.on_status is not None:
+            self.on_status("running")
+        if self.ready_future is not None and not self.ready_future.done():
+            logging.info("GPU service is running")
+            self.ready_future.set_result(True)
+
+    async def handle_heartbeat(self, msg):
+        status = msg.data.decode() or "running"
+        if status == "running":
+            self.mark_ready()
+        elif self.on_status is not None:
+            self.on_status(status)
+
+    async def poll(self):
+        backoff = self.initial_backoff
+        while self.num_waiters > 0 and not self.ready_future.done():
+            if await self.check_status() == "running":
+                self.mark_ready()
+                return
+            await asyncio.sleep(random.uniform(backoff / 2, backoff))
+            backoff = min(self.max_backoff, backoff * 2)
+
+    async def wait_until_ready(self, timeout):
+        # Return True as soon as the GPU service is running, or False after timeout seconds.
+        if self.ready_future is None or self.ready_future.done():
+            self.ready_future = asyncio.get_event_loop().create_future()
+        ready_future = self.ready_future
+        self.num_waiters += 1
+        try:
+            if self.poller_task is None or self.poller_task.done():
+                self.poller_task = asyncio.ensure_future(self.poll())
+            await asyncio.wait_for(asyncio.shield(ready_future), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            self.num_waiters -= 1
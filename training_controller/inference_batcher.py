@@ -0,0 +1,72 @@
+# Standard Library
+import asyncio
+import logging
+import os
+
+# Third Party
+from controller_metrics import ADMISSION_DECISIONS
+
+INFERENCE_BATCHING_ENABLED = (
+    os.getenv("INFERENCE_BATCHING_ENABLED", "false").lower() == "true"
+)
+INFERENCE_BATCH_MAX_SIZE = int(os.getenv("INFERENCE_BATCH_MAX_SIZE", 64))
+# unit: seconds. Maximum latency added to an admitted inference request by batching.
+INFERENCE_BATCH_MAX_LATENCY = float(os.getenv("INFERENCE_BATCH_MAX_LATENCY", 0.05))
+INFERENCE_BATCH_SUBJECT = os.getenv(
+    "INFERENCE_BATCH_SUBJECT", "gpu_service_inference_internal_batch"
+)
+
+
+class InferenceBatcher:
+    """
+    Collect admitted inference payloads and publish them to the GPU service as one message.
+    A batch is published once it holds max_size payloads or once its oldest payload has waited
+    max_latency seconds. The batch is a JSON array of the original payloads, which are JSON
+    documents themselves. The replies are fanned back to the original reply subjects after the
+    batch was published: YES if it was handed over to the GPU service, NO otherwise.
+    """
+
+    def __init__(
+        self,
+        publish,
+        subject=INFERENCE_BATCH_SUBJECT,
+        max_size=INFERENCE_BATCH_MAX_SIZE,
+        max_latency=INFERENCE_BATCH_MAX_LATENCY,
+    ):
+        self.publish = publish
+        self.subject = subject
+        self.max_size = max_size
+        self.max_latency = max_latency
+        self.pending = []
+        self.flush_timer = None
+
+    async def submit(self, payload, reply_subject):
+        self.pending.append((payload, reply_subject))
+        if len(self.pending) >= self.max_size:
+            await self.flush()
+        elif self.flush_timer is None:
+            self.flush_timer = asyncio.get_event_loop().call_later(
+                self.max_latency, lambda: asyncio.ensure_future(self.flush())
+            )
+
+    async def flush(self):
+        if self.flush_timer is not None:
+            self.flush_timer.cancel()
+            self.flush_timer = None
+        batch, self.pending = self.pending, []
+        if len(batch) == 0:
+            return
+        batch_payload = b"[" + b",".join(payload for payload, _ in batch) + b"]"
+        try:
+            await self.publish(self.subject, batch_payload)
+            reply_message = b"YES"
+        except Exception as e:
+            logging.error(f"Failed to publish inference batch, error: {e}")
+            reply_message = b"NO"
+        logging.info(
+            f"published inference batch of {len(batch)} requests. response : {reply_message}"
+        )
+        ADMISSION_DECISIONS.labels(reply_message.decode()).inc(len(batch))
+        for _, reply_subject in batch:
+            if reply_subject:
+                await self.publish(reply_subject, reply_message)
@@ -0,0 +1,142 @@
+# Standard Library
+import logging
+import os
+
+# Third Party
+from controller_metrics import ES_REQUEST_SECONDS
+
+NORMAL_INTERVALS_INDEX = "opni-normal-intervals"
+# Number of update and delete actions sent in one _bulk request.
+RECONCILIATION_BULK_SIZE = int(os.getenv("RECONCILIATION_BULK_SIZE", 1000))
+
+
+class IntervalAction:
+    """
+    An update or delete of a document of opni-normal-intervals, together with the training data
+    files to remove once Elasticsearch has acknowledged it.
+    """
+
+    def __init__(self, op_type, normal_interval, files, start_ts=None):
+        self.op_type = op_type
+        self.normal_interval = normal_interval
+        self.files = files
+        self.start_ts = start_ts
+
+    def bulk_lines(self):
+        metadata = {
+            "_index": NORMAL_INTERVALS_INDEX,
+            "_id": self.normal_interval["_id"],
+        }
+        if "_type" in self.normal_interval:
+            metadata["_type"] = self.normal_interval["_type"]
+        if self.op_type == "delete":
+            return [{"delete": metadata}]
+        return [{"update": metadata}, {"doc": {"start_ts": self.start_ts}}]
+
+    def is_acknowledged(self, item_result):
+        # A delete of an interval which is already gone leaves nothing behind either.
+        status = item_result.get("status", 500)
+        return 200 <= status < 300 or (self.op_type == "delete" and status == 404)
+
+
+class ReconciliationPlan:
+    """
+    Result of comparing the normal intervals with the time range of the logs still stored:
+    the intervals to export, the actions to apply on opni-normal-intervals and the stale
+    training data files which can be removed right away.
+    """
+
+    def __init__(self):
+        self.timestamps_list = []
+        self.actions = []
+        self.stale_files = []
+
+
+def plan_reconciliation(
+    normal_intervals, oldest_log_timestamp, newest_log_timestamp, manifest
+):
+    plan = ReconciliationPlan()
+    for normal_interval in normal_intervals:
+        start_ts, end_ts = (
+            normal_interval["_source"]["start_ts"],
+            normal_interval["_source"]["end_ts"],
+        )
+        # Fetch only the files which hold exactly the window from start_ts to end_ts.
+        interval_json_files = manifest.files(start_ts, end_ts)
+
+        # If the end_ts is before the oldest_log_timestamp, then that interval should be removed from Elasticsearch as the data no longer exists.
+        if end_ts < oldest_log_timestamp:
+            plan.actions.append(
+                IntervalAction("delete", normal_interval, interval_json_files)
+            )
+        # Address scenarios where start_ts comes before the oldest_log_timestamp
+        elif start_ts < oldest_log_timestamp:
+            """
+            If end_ts is after the newest_log_timestamp, then set the start_ts to oldest_log_timestamp,
+            keep the end_ts the same and set the filename to be named with the oldest_log_timestamp and
+            newest_log_timestamp. Otherwise, set the filename to be named after the oldest_log_timestamp and end_ts.
+            """
+            filename_end_ts = min(end_ts, newest_log_timestamp)
+            plan.timestamps_list.append(
+                {
+                    "start_ts": oldest_log_timestamp,
+                    "end_ts": end_ts,
+                    "filename": f"{oldest_log_timestamp}_{filename_end_ts}.json",
+                }
+            )
+            # Update start_ts value to oldest_log_timestamp, the old files go once it is acknowledged.
+            plan.actions.append(
+                IntervalAction(
+                    "update", normal_interval, interval_json_files, oldest_log_timestamp
+                )
+            )
+        # Address scenario where start_ts is on or after oldest_log_timestamp and end_ts is after newest_log_timestamp.
+        elif end_ts > newest_log_timestamp:
+            plan.timestamps_list.append(
+                {
+                    "start_ts": start_ts,
+                    "end_ts": end_ts,
+                    "filename": f"{start_ts}_{newest_log_timestamp}.json",
+                }
+            )
+        # Address scenario where start_ts is on or after oldest_log_timestamp and end_ts is before or on newest_log_timestamp.
+        # If there already exist files of the window, do not fetch that data again.
+        elif len(interval_json_files) == 0:
+            # Files of windows beginning at start_ts but ending elsewhere are outdated.
+            plan.stale_files.extend(manifest.files_starting_at(start_ts))
+            plan.timestamps_list.append(
+                {
+                    "start_ts": start_ts,
+                    "end_ts": end_ts,
+                    "filename": f"{start_ts}_{end_ts}.json",
+                }
+            )
+    return plan
+
+
+async def apply_actions(es_instance, actions, bulk_size=RECONCILIATION_BULK_SIZE):
+    # Apply the actions with the _bulk API and return the ones Elasticsearch acknowledged.
+    acknowledged_actions = []
+    for first_idx in range(0, len(actions), bulk_size):
+        actions_chunk = actions[first_idx : first_idx + bulk_size]
+        bulk_body = [line for action in actions_chunk for line in action.bulk_lines()]
+        try:
+            with ES_REQUEST_SECONDS.labels("bulk").time():
+                result = await es_instance.bulk(body=bulk_body)
+        except Exception as e:
+            logging.error(f"Error applying {len(actions_chunk)} interval actions: {e}")
+            continue
+        # Items are returned in the order of the actions, keyed by their operation type.
+        for action, item in zip(actions_chunk, result["items"]):
+            item_result = item[action.op_type]
+            if action.is_acknowledged(item_result):
+                acknowledged_actions.append(action)
+            else:
+                logging.error(
+                    f"Failed to {action.op_type} interval {action.normal_interval['_id']}: "
+                    f"{item_result.get('error')}"
+                )
+    logging.info(
+        f"Applied {len(acknowledged_actions)} of {len(actions)} interval actions on {NORMAL_INTERVALS_INDEX}"
+    )
+    return acknowledged_actions
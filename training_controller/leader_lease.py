@@ -0,0 +1,96 @@
+# Standard Library
+import asyncio
+import json
+import logging
+import os
+import time
+import uuid
+
+# Third Party
+from nats.js.errors import KeyNotFoundError
+
+LEADER_LEASE_BUCKET = "model-training-parameters"
+LEADER_LEASE_KEY = "controllerLeader"
+# unit: seconds.
+LEADER_LEASE_TIME = float(os.getenv("LEADER_LEASE_TIME", 30))
+REPLICA_ID = os.getenv("HOSTNAME") or uuid.uuid4().hex
+
+
+class LeaderLease:
+    """
+    Lease-based leader lock of the training controller replicas, stored in NATS KV.
+    The lease records its holder and expiry time. It is created or taken over with compare and
+    swap writes on the revision of the key, so only one replica can hold it at a time. The
+    holder renews it every third of the lease time, and another replica takes it over once it
+    has expired.
+    """
+
+    def __init__(
+        self,
+        nw,
+        replica_id=REPLICA_ID,
+        lease_time=LEADER_LEASE_TIME,
+        bucket_name=LEADER_LEASE_BUCKET,
+        key=LEADER_LEASE_KEY,
+    ):
+        self.nw = nw
+        self.replica_id = replica_id
+        self.lease_time = lease_time
+        self.bucket_name = bucket_name
+        self.key = key
+        self.expires_at = 0
+        self.lock = asyncio.Lock()
+        self.renew_task = None
+
+    def is_leader(self):
+        return time.time() < self.expires_at
+
+    async def try_acquire(self):
+        kv = (await self.nw.get_bucket(self.bucket_name)).kv
+        now = time.time()
+        lease_payload = json.dumps(
+            {"holder": self.replica_id, "expires_at": now + self.lease_time}
+        ).encode()
+        try:
+            entry = await kv.get(self.key)
+        except KeyNotFoundError:
+            entry = None
+        if entry is None or not entry.value:
+            await kv.create(self.key, lease_payload)
+        else:
+            lease = json.loads(entry.value.decode())
+            if lease["holder"] != self.replica_id and lease["expires_at"] > now:
+                return False
+            await kv.update(self.key, lease_payload, last=entry.revision)
+        return True
+
+    async def acquire(self):
+        # Take or renew the lease and return whether this replica is the leader.
+        async with self.lock:
+            was_leader = self.is_leader()
+            acquired_at = time.time()
+            try:
+                acquired = await self.try_acquire()
+            except Exception as e:
+                # A concurrent write by another replica or an unreachable bucket.
+                logging.warning(f"Failed to acquire the leader lease, error: {e}")
+                acquired = False
+            self.expires_at = acquired_at + self.lease_time if acquired else 0
+            if acquired != was_leader:
+                logging.info(
+                    f"Replica {self.replica_id} {'is' if acquired else 'is no longer'} the leader"
+                )
+            return acquired
+
+    async def ensure_leader(self):
+        # Cheap check for the hot paths, the KV is only read when the lease is not held.
+        return self.is_leader() or await self.acquire()
+
+    async def run(self):
+        while True:
+            await self.acquire()
+            await asyncio.sleep(self.lease_time / 3)
+
+    def start(self):
+        if self.renew_task is None or self.renew_task.done():
+            self.renew_task = asyncio.ensure_future(self.run())
@@ -6,45 +6,65 @@ import os
 import time
 
 # Third Party
-import boto3
-import requests
-from botocore.client import Config
-from elasticsearch import AsyncElasticsearch
-from opni_nats import NatsWrapper
-from prepare_training_logs import PrepareTrainingLogs
-
-ES_ENDPOINT = os.environ["ES_ENDPOINT"]
-ES_USERNAME = os.environ["ES_USERNAME"]
-ES_PASSWORD = os.environ["ES_PASSWORD"]
-# s3 config values
-S3_ACCESS_KEY = os.environ["S3_ACCESS_KEY"]
-S3_SECRET_KEY = os.environ["S3_SECRET_KEY"]
-S3_ENDPOINT = os.environ["S3_ENDPOINT"]
+import orjson
+from clients import get_es_instance, get_nats_wrapper, get_s3_resource
+from controller_metrics import (
+    ADMISSION_DECISIONS,
+    ES_REQUEST_SECONDS,
+    monitor_event_loop_lag,
+    start_metrics_server,
+    timed_handler,
+)
+from gpu_admission import GpuAdmissionState
+from gpu_job_tracker import GpuJobTracker, new_job_id
+from gpu_service_readiness import (
+    GPU_SERVICE_READINESS_SUBJECT,
+    GpuServiceReadinessWatcher,
+)
+from inference_batcher import INFERENCE_BATCHING_ENABLED, InferenceBatcher
+from leader_lease import LeaderLease
+from model_artifact_cache import ModelArtifactCache
+from opni_internal_client import ModelStatusPoster, OpniInternalClient
+from single_flight import SingleFlight
+from training_budget_cache import TrainingBudgetCache
+from training_parameters_mirror import (
+    LAST_MODEL_TRAINED_KEY,
+    MODEL_TRAINING_PARAMETERS_BUCKET,
+    MODEL_TRAINING_PARAMETERS_KEY,
+    TrainingParametersMirror,
+)
+from training_payload_store import TrainingPayloadStore, summarize_training_payload
+from training_query import TrainingQueryCompiler
+from workload_fingerprint import WorkloadTree, diff_workloads
+
+# unit: seconds. Reference point of the startup time reported once requests are served.
+STARTUP_TIME = time.monotonic()
+# The Elasticsearch, S3 and NATS clients are configured and created lazily in clients.py.
 S3_BUCKET = os.getenv("S3_BUCKET", "opni-nulog-models")
 MODEL_STATS_ENDPOINT = "http://opni-internal:11080/ModelTraining/model/current_status"
 RETRY_LIMIT = 15
-
-es_instance = AsyncElasticsearch(
-    [ES_ENDPOINT],
-    port=9200,
-    http_auth=(ES_USERNAME, ES_PASSWORD),
-    verify_certs=False,
-    use_ssl=True,
-)
-
-s3_client = boto3.resource(
-    "s3",
-    endpoint_url=S3_ENDPOINT,
-    aws_access_key_id=S3_ACCESS_KEY,
-    aws_secret_access_key=S3_SECRET_KEY,
-    config=Config(signature_version="s3v4"),
+# unit: seconds. How long training waits for the GPU service to be running.
+GPU_SERVICE_READY_TIMEOUT = RETRY_LIMIT * 30
+
+model_artifact_cache = ModelArtifactCache(get_s3_resource, S3_BUCKET)
+
+nw = get_nats_wrapper()
+# Replicas share the inference admission and model status requests through this queue group,
+# training is only scheduled by the replica holding the leader lease.
+CONTROLLER_QUEUE_GROUP = os.getenv("CONTROLLER_QUEUE_GROUP", "training-controller")
+leader_lease = LeaderLease(nw)
+training_budget_cache = TrainingBudgetCache()
+# unit: seconds. Lease of a GPU training job which reports no progress, it must exceed the
+# longest training run as the GPU service only reports JobStart and JobEnd.
+GPU_TRAINING_LEASE_TIME = float(os.getenv("GPU_TRAINING_LEASE_TIME", 3600))
+training_payload_store = TrainingPayloadStore(nw)
+# The payload stored for a job is deleted once the job ends.
+gpu_job_tracker = GpuJobTracker(
+    nw, lease_time=GPU_TRAINING_LEASE_TIME, on_job_end=training_payload_store.release
 )
-
-nw = NatsWrapper()
-GPU_TRAINING_RESET_TIME = 3600
-gpu_training_request = 0
-last_trainingjob_time = 0
 GPU_GATEWAY_ENDPOINT = "http://opni-internal:11080/ModelTraining/gpu_info"
+opni_internal_client = OpniInternalClient()
+model_status_poster = ModelStatusPoster(opni_internal_client, MODEL_STATS_ENDPOINT)
 # unit: ms. With introducing streaming data loader, it's possible to download much more training data.
 TRAINING_DATA_INTERVAL = 3600 * 1000 * 1
 ANOMALY_KEYWORDS = [
@@ -61,27 +81,17 @@ ANOMALY_KEYWORDS = [
     "out of disk",
     "high load",
 ]
+training_query_compiler = TrainingQueryCompiler(ANOMALY_KEYWORDS)
 
 
 def post_model_status(status):
-    model_training_status = {"status": status}
-    try:
-        result = requests.put(
-            MODEL_STATS_ENDPOINT, data=json.dumps(model_training_status).encode(),
-            headers={"Content-Type": "application/json", "Accept" : "application/json"},
-        )
-        logging.info(f"Posted training status, result: {result}")
-    except Exception as e:
-        logging.warning(f"Failed to post training status, error: {e}")
+    # Status updates are queued and sent in the background, only the latest pending one is posted.
+    model_status_poster.post(status)
 
 
-def get_gpu_status():
+async def get_gpu_status():
     try:
-        results = requests.get(
-            GPU_GATEWAY_ENDPOINT,
-            headers={"Content-Type": "application/json", "Accept" : "application/json"},
-        )
-        decoded_result = json.loads(results.content.decode())
+        decoded_result = await opni_internal_client.get_json(GPU_GATEWAY_ENDPOINT)
         if "items" in decoded_result:
             gpu_resources_list = decoded_result["items"]
             for gpu_info in gpu_resources_list:
@@ -108,16 +118,39 @@ async def get_gpu_service_status():
         return "unavailable"
 
 
+gpu_admission_state = GpuAdmissionState(get_gpu_status, get_gpu_service_status)
+gpu_service_readiness = GpuServiceReadinessWatcher(
+    get_gpu_service_status, on_status=gpu_admission_state.set_gpu_service_status
+)
+inference_batcher = InferenceBatcher(nw.publish)
+
+
 async def get_nats_bucket_kv():
+    # The parameters are served from the in-memory mirror once it has loaded the bucket.
+    if training_parameters_mirror.is_loaded():
+        current_workload_parameters = training_parameters_mirror.get(
+            MODEL_TRAINING_PARAMETERS_KEY
+        )
+        last_trained_payload_dict = training_parameters_mirror.get(
+            LAST_MODEL_TRAINED_KEY
+        )
+    else:
+        model_training_bucket = await nw.get_bucket(MODEL_TRAINING_PARAMETERS_BUCKET)
+        current_bucket_payload = await model_training_bucket.get(
+            MODEL_TRAINING_PARAMETERS_KEY
+        )
+        last_trained_bucket_payload = await model_training_bucket.get(
+            LAST_MODEL_TRAINED_KEY
+        )
+        current_workload_parameters = json.loads(current_bucket_payload.decode())
+        last_trained_payload_dict = (
+            json.loads(last_trained_bucket_payload.decode())
+            if last_trained_bucket_payload
+            else None
+        )
     result_dict = dict()
-    model_training_bucket = await nw.get_bucket("model-training-parameters")
-    current_bucket_payload = await model_training_bucket.get("modelTrainingParameters")
-    last_trained_bucket_payload = await model_training_bucket.get("lastModelTrained")
-    result_dict["current_workload_parameters"] = json.loads(
-        current_bucket_payload.decode()
-    )
-    if last_trained_bucket_payload:
-        last_trained_payload_dict = json.loads(last_trained_bucket_payload.decode())
+    result_dict["current_workload_parameters"] = current_workload_parameters
+    if last_trained_payload_dict:
         if "payload" in last_trained_payload_dict:
             result_dict["last_trained_workload_parameters"] = last_trained_payload_dict[
                 "payload"
@@ -126,28 +159,18 @@ async def get_nats_bucket_kv():
 
 
 def check_training_necessary(
-    previous_workload_parameters_dict: dict, current_workload_parameters_dict: dict
+    previous_workload_parameters_dict: dict, current_workload_tree: WorkloadTree
 ):
-    for cluster_id in current_workload_parameters_dict["workloads"]:
-        if not cluster_id in previous_workload_parameters_dict["workloads"]:
-            return True
-        for namespace_name in current_workload_parameters_dict["workloads"][cluster_id]:
-            if (
-                not namespace_name
-                in previous_workload_parameters_dict["workloads"][cluster_id]
-            ):
-                return True
-            for deployment_name in current_workload_parameters_dict["workloads"][
-                cluster_id
-            ][namespace_name]:
-                if (
-                    not deployment_name
-                    in previous_workload_parameters_dict["workloads"][cluster_id][
-                        namespace_name
-                    ]
-                ):
-                    return True
-    return False
+    # Training is necessary whenever a deployment was added or removed since the last trained model.
+    workload_delta = diff_workloads(
+        WorkloadTree(previous_workload_parameters_dict["workloads"]),
+        current_workload_tree,
+    )
+    if workload_delta.has_changes():
+        logging.info(
+            f"Workloads changed since the last trained model, {workload_delta}"
+        )
+    return workload_delta.has_changes()
 
 
 async def schedule_model_training():
@@ -155,6 +178,7 @@ async def schedule_model_training():
     current_workload_parameters_dict = model_training_bucket_dict[
         "current_workload_parameters"
     ]
+    current_workload_tree = WorkloadTree(current_workload_parameters_dict["workloads"])
     model_training_necessary = True
     if "last_trained_workload_parameters" in model_training_bucket_dict:
         last_trained_payload_dict = model_training_bucket_dict[
@@ -162,21 +186,18 @@ async def schedule_model_training():
         ]
         if "workloads" in last_trained_payload_dict:
             model_training_necessary = check_training_necessary(
-                last_trained_payload_dict, current_workload_parameters_dict
+                last_trained_payload_dict, current_workload_tree
             )
     workload_parameter_payload = {
         "workloads": current_workload_parameters_dict["workloads"]
     }
 
     if model_training_necessary:
-        gpu_service_status = await get_gpu_service_status()
-        num_retries = 0
-        while gpu_service_status != "running" and num_retries < RETRY_LIMIT:
-            await asyncio.sleep(30)
-            gpu_service_status = await get_gpu_service_status()
-            num_retries += 1
-        if gpu_service_status == "running":
-            await train_model(current_workload_parameters_dict)
+        # Every concurrent trigger shares the same readiness wait and poller.
+        if await gpu_service_readiness.wait_until_ready(GPU_SERVICE_READY_TIMEOUT):
+            await train_model(
+                current_workload_parameters_dict, current_workload_tree.root_digest
+            )
             workload_parameter_payload["status_type"] = "train"
             await nw.publish(
                 "model_workload_parameters",
@@ -197,52 +218,42 @@ async def schedule_model_training():
         post_model_status(status="completed")
 
 
-async def train_model(workload_parameters_dict):
-    if gpu_training_request == 0:
-        max_logs_for_training = PrepareTrainingLogs().get_num_logs_for_training()
+training_scheduler = SingleFlight(schedule_model_training)
+
+
+async def trigger_model_training(workload_parameters_dict):
+    """
+    Run schedule_model_training through the single-flight layer. Triggers for the same workloads
+    join the run in flight, any other triggers collapse into one follow-up run which reads the
+    latest workload parameters from Nats kv.
+    """
+    if not await leader_lease.ensure_leader():
+        logging.info("Training is scheduled by the leader replica")
+        return None
+    workloads_key = None
+    if "workloads" in workload_parameters_dict:
+        workloads_key = WorkloadTree(workload_parameters_dict["workloads"]).root_digest
+    return await training_scheduler.trigger(workloads_key)
+
+
+async def train_model(workload_parameters_dict, workloads_key=None):
+    if not gpu_job_tracker.is_training():
+        es_instance = get_es_instance()
+        max_logs_for_training = await training_budget_cache.get_num_logs_for_training(
+            es_instance
+        )
         end_ts = int(time.time() * 1000)
         start_ts = end_ts - TRAINING_DATA_INTERVAL
-        parentheses_keywords = [f"({x})" for x in ANOMALY_KEYWORDS]
         workload_parameters = workload_parameters_dict["workloads"]
-        model_logs_query_body = {
-            "query": {
-                "bool": {
-                    "filter": [{"range": {"time": {"gte": start_ts, "lte": end_ts}}}],
-                    "minimum_should_match": 1,
-                    "should": [],
-                    "must_not": [
-                        {"match": {"anomaly_level.keyword": "Anomaly"}},
-                        {
-                            "query_string": {
-                                "query": " or ".join(parentheses_keywords),
-                                "default_field": "log",
-                            }
-                        },
-                    ],
-                },
-            }
-        }
-        for cluster_id in workload_parameters:
-            for namespace_name in workload_parameters[cluster_id]:
-                for deployment_name in workload_parameters[cluster_id][namespace_name]:
-                    should_query_string = {
-                        "query_string": {
-                            "fields": [
-                                "cluster_id",
-                                "namespace_name.keyword",
-                                "deployment.keyword",
-                            ],
-                            "query": f"{cluster_id} AND {namespace_name} AND {deployment_name}",
-                        }
-                    }
-                    model_logs_query_body["query"]["bool"]["should"].append(
-                        should_query_string
-                    )
+        model_logs_query_body = training_query_compiler.compile(
+            workload_parameters, start_ts, end_ts, workloads_key
+        )
         # This function handles get requests for fetching pod,namespace and workload breakdown insights.
         logging.info(f"Received request to train model.")
-        training_data_count = (
-            await es_instance.count(index="logs", body=model_logs_query_body)
-        )["count"]
+        with ES_REQUEST_SECONDS.labels("count").time():
+            training_data_count = (
+                await es_instance.count(index="logs", body=model_logs_query_body)
+            )["count"]
         payload_query = {
             "max_size": max_logs_for_training,
             "query": model_logs_query_body,
@@ -250,8 +261,11 @@ async def train_model(workload_parameters_dict):
             "parameters": workload_parameters_dict,
         }
         try:
-            await nw.publish("train", json.dumps(payload_query).encode())
-            logging.info(f"payload : {payload_query}")
+            # Large payloads are published as a reference to their copy in NATS KV.
+            await nw.publish(
+                "train", await training_payload_store.encode(payload_query)
+            )
+            logging.info(f"payload : {summarize_training_payload(payload_query)}")
             return b"submitted request to train model"
         except Exception as e:
             # Bad Request
@@ -261,22 +275,11 @@ async def train_model(workload_parameters_dict):
         return b"currently unable to train model. please try again later."
 
 
-def verify_model_saved():
-    bucket = s3_client.Bucket("opni-nulog-models")
-    model_file = "nulog_model_latest.pt"
-    try:
-        objs = list(bucket.objects.filter(Prefix=model_file))
-        return len(objs) > 0
-    except Exception as e:
-        logging.error(e)
-        return False
-
-
 async def get_model_status():
-    if gpu_training_request > 0:
+    if gpu_job_tracker.is_training():
         return b"training"
     else:
-        if verify_model_saved():
+        if model_artifact_cache.model_saved:
             return b"completed"
         else:
             return b"not started"
@@ -300,13 +303,24 @@ async def get_workloads_from_nats():
             if workload_parameters_dict["uuid"] != last_trained_payload["uuid"] and (
                 "workloads" in workload_parameters_dict
             ):
-                await schedule_model_training()
+                await trigger_model_training(workload_parameters_dict)
         else:
-            await schedule_model_training()
+            await trigger_model_training(workload_parameters_dict)
     except Exception as e:
         logging.error(e)
 
 
+async def on_training_parameters_change(key, value):
+    # New workload parameters are compared with the last trained ones as soon as they are stored.
+    if key == MODEL_TRAINING_PARAMETERS_KEY and value is not None:
+        await get_workloads_from_nats()
+
+
+training_parameters_mirror = TrainingParametersMirror(
+    nw, on_change=on_training_parameters_change
+)
+
+
 async def consume_request():
     """
     consume incoming requests for inference on gpu-service.
@@ -314,69 +328,100 @@ async def consume_request():
     inference requests get accepted only if there's no training jobs in queue.
     """
 
+    @timed_handler("gpu_available")
     async def gpu_available(msg):
-        global gpu_training_request
-        global last_trainingjob_time
         message = msg.data.decode()
         logging.info(f"message from training : {message}")
-        if (
-            message == "JobStart"
-        ):  ## "JobStart" is published from function schedule_training_job()
-            gpu_training_request += 1
-            last_trainingjob_time = time.time()
-        elif message == "JobEnd":
-            gpu_training_request -= 1
-
+        ## "JobStart" is published from function schedule_training_job()
+        status = gpu_job_tracker.handle_status_message(message)
+        # Every replica tracks the jobs, the leader persists them.
+        if status in ("JobStart", "JobEnd") and leader_lease.is_leader():
+            await gpu_job_tracker.save()
+        if status == "JobEnd":
+            model_artifact_cache.invalidate()
+        gpu_admission_state.on_training_job_status(status)
+
+    @timed_handler("receive_and_reply")
     async def receive_and_reply(msg):
-        global last_trainingjob_time
         reply_subject = msg.reply
-        gpu_status = get_gpu_status()
-        gpu_service_status = await get_gpu_service_status()
-        if (
-            gpu_training_request > 0
-            or gpu_status == "unavailable"
-            or gpu_service_status == "unavailable"
-        ):
+        # Admission is answered from the cached GPU state, refreshed inline only when stale.
+        if gpu_job_tracker.is_training() or not await gpu_admission_state.admit():
             reply_message = b"NO"
+        elif INFERENCE_BATCHING_ENABLED:
+            # The batcher replies once the batch holding this request has been published.
+            await inference_batcher.submit(msg.data, reply_subject)
+            return
         else:  ## gpu service available for inference
             await nw.publish("gpu_service_inference_internal", msg.data)
             reply_message = b"YES"
+        ADMISSION_DECISIONS.labels(reply_message.decode()).inc()
         logging.info(f"received inferencing request. response : {reply_message}")
         await nw.publish(reply_subject, reply_message)
 
+    await gpu_job_tracker.load()
+    gpu_admission_state.start()
     await nw.subscribe("gpu_trainingjob_status", subscribe_handler=gpu_available)
-    await nw.subscribe("gpu_service_inference", subscribe_handler=receive_and_reply)
+    await nw.subscribe(
+        GPU_SERVICE_READINESS_SUBJECT,
+        subscribe_handler=gpu_service_readiness.handle_heartbeat,
+    )
+    await nw.subscribe(
+        "gpu_service_inference",
+        nats_queue=CONTROLLER_QUEUE_GROUP,
+        subscribe_handler=receive_and_reply,
+    )
+    logging.info(
+        f"Serving inference admission requests {time.monotonic() - STARTUP_TIME:.3f}s after startup"
+    )
 
 
 async def endpoint_backends():
+    @timed_handler("model_status_sub_handler")
     async def model_status_sub_handler(msg):
         reply_subject = msg.reply
         reply_message = await get_model_status()
         await nw.publish(reply_subject, reply_message)
 
+    @timed_handler("train_reset_model_sub_handler")
     async def train_reset_model_sub_handler(msg):
+        # Every replica receives the request, the leader answers and handles it.
+        if not await leader_lease.ensure_leader():
+            return
         reply_subject = msg.reply
         training_payload = json.loads(msg.data.decode())
         if "workloads" in training_payload:
             await nw.publish(reply_subject, b"training job submitted")
-            await schedule_model_training()
+            await trigger_model_training(training_payload)
         else:
             await nw.publish(reply_subject, b"model reset")
             model_reset_payload = {"status": "reset"}
+            # Every replica invalidates its model artifact cache on model_update.
             await nw.publish("model_update", json.dumps(model_reset_payload).encode())
             reset_payload = {"workloads": {}, "status_type": "reset"}
             await nw.publish(
                 "model_workload_parameters", json.dumps(reset_payload).encode()
             )
             model_training_parameters_bucket = await nw.get_bucket(
-                "model-training-parameters"
+                MODEL_TRAINING_PARAMETERS_BUCKET
             )
             operation = await model_training_parameters_bucket.put(
-                "lastModelTrained", json.dumps({}).encode()
+                LAST_MODEL_TRAINED_KEY, json.dumps({}).encode()
             )
 
-    await nw.subscribe("model_status", subscribe_handler=model_status_sub_handler)
+    @timed_handler("model_update_sub_handler")
+    async def model_update_sub_handler(msg):
+        model_artifact_cache.invalidate()
+
     await nw.subscribe("train_model", subscribe_handler=train_reset_model_sub_handler)
+    # Not a queue subscription, the model status of every replica follows the updates.
+    await nw.subscribe("model_update", subscribe_handler=model_update_sub_handler)
+    # Model status requests are answered once the artifact was checked, or the check timed out.
+    await model_artifact_cache.start()
+    await nw.subscribe(
+        "model_status",
+        nats_queue=CONTROLLER_QUEUE_GROUP,
+        subscribe_handler=model_status_sub_handler,
+    )
 
 
 async def schedule_training_job(payload):
@@ -384,17 +429,27 @@ async def schedule_training_job(payload):
     prepare the training data and launch nulog-train job
     """
     model_to_train = payload["model"]
+    if not await leader_lease.ensure_leader():
+        logging.info("Training job is scheduled by the leader replica")
+        return
     if model_to_train == "nulog-train":
+        # The job id is only carried by the training payload, gpu_trainingjob_status keeps the
+        # plain JobStart, whose echo is ignored as the job is already running here.
+        payload["job_id"] = new_job_id()
+        training_payload_store.claim(payload["job_id"], payload["payload"])
+        gpu_job_tracker.start_job(payload["job_id"])
         await nw.publish("gpu_trainingjob_status", b"JobStart")  # update gpu status
         await nw.publish(
-            "gpu_service_training_internal", (json.dumps(payload)).encode()
+            "gpu_service_training_internal", orjson.dumps(payload)
         )  # schedule job
 
 
 async def main():
+    @timed_handler("consume_nats_signal")
     async def consume_nats_signal(msg):
         try:
-            decoded_payload = json.loads(msg.data.decode())
+            # The payload may be a payload_ref, which is forwarded for the GPU service to resolve.
+            decoded_payload = orjson.loads(msg.data)
             training_job_payload = {
                 "source": "drain",
                 "model": "nulog-train",
@@ -405,7 +460,11 @@ async def main():
         except Exception as e:
             logging.error(e)
 
+    leader_lease.start()
+    # The initial values delivered by the watch replace checking the workloads at startup.
+    training_parameters_mirror.start()
     await nw.subscribe("train", subscribe_handler=consume_nats_signal)
+    asyncio.ensure_future(monitor_event_loop_lag())
 
 
 async def init_nats():
@@ -414,19 +473,18 @@ async def init_nats():
 
 
 if __name__ == "__main__":
+    start_metrics_server()
     loop = asyncio.get_event_loop()
     task = loop.create_task(init_nats())
     loop.run_until_complete(task)
     consume_request_coroutine = consume_request()
     plugin_backends_coroutine = endpoint_backends()
-    latest_workload_coroutine = get_workloads_from_nats()
     main_coroutine = main()
     loop.run_until_complete(
         asyncio.gather(
             main_coroutine,
             consume_request_coroutine,
             plugin_backends_coroutine,
-            latest_workload_coroutine,
         )
     )
     try:
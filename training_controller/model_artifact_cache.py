@@ -0,0 +1,107 @@
+# Standard Library
+import asyncio
+import logging
+import os
+
+# Third Party
+from controller_metrics import S3_REQUEST_SECONDS
+from single_flight import SingleFlight
+
+# unit: seconds.
+MODEL_ARTIFACT_REFRESH_INTERVAL = float(
+    os.getenv("MODEL_ARTIFACT_REFRESH_INTERVAL", 60)
+)
+# unit: seconds. How long start waits for the first check before serving the state anyway.
+MODEL_ARTIFACT_FIRST_CHECK_TIMEOUT = float(
+    os.getenv("MODEL_ARTIFACT_FIRST_CHECK_TIMEOUT", 5)
+)
+MODEL_FILE = "nulog_model_latest.pt"
+
+
+class ModelArtifactCache:
+    """
+    In-memory state of the trained model artifact in S3.
+    The artifact is checked with head_object in the default thread pool, periodically and
+    whenever the cache is invalidated after a training job completes, so model status requests
+    are answered from memory without doing S3 I/O on the event loop. The S3 resource is fetched
+    with get_s3_resource on the first check, so it is created off the event loop as well.
+    start waits for a first check of the artifact, up to first_check_timeout seconds, so the
+    state is normally known before it is served even when S3 is slow or unreachable.
+    """
+
+    def __init__(
+        self,
+        get_s3_resource,
+        bucket_name,
+        model_file=MODEL_FILE,
+        refresh_interval=MODEL_ARTIFACT_REFRESH_INTERVAL,
+        first_check_timeout=MODEL_ARTIFACT_FIRST_CHECK_TIMEOUT,
+    ):
+        self.get_s3_resource = get_s3_resource
+        self.bucket_name = bucket_name
+        self.model_file = model_file
+        self.refresh_interval = refresh_interval
+        self.first_check_timeout = first_check_timeout
+        self.model_saved = False
+        self.etag = None
+        self.refresh_flight = SingleFlight(self.fetch_and_update)
+        self.refresh_task = None
+
+    def head_model_object(self):
+        # Return the ETag of the model artifact or None if it does not exist.
+        # Third Party
+        from botocore.exceptions import ClientError
+
+        s3_client = self.get_s3_resource().meta.client
+        try:
+            with S3_REQUEST_SECONDS.labels("head_object").time():
+                response = s3_client.head_object(
+                    Bucket=self.bucket_name, Key=self.model_file
+                )
+            return response["ETag"]
+        except ClientError as e:
+            if e.response["Error"]["Code"] in ("404", "NoSuchKey", "NotFound"):
+                return None
+            raise
+
+    async def fetch_and_update(self):
+        etag = await asyncio.get_event_loop().run_in_executor(
+            None, self.head_model_object
+        )
+        if etag != self.etag:
+            logging.info(f"Model artifact {self.model_file} changed, ETag : {etag}")
+        self.etag = etag
+        self.model_saved = etag is not None
+
+    async def refresh(self, join=True):
+        # Only one S3 check runs at a time, callers arriving meanwhile wait for its result.
+        # Without join, a new check follows the one in flight, which may predate a change.
+        try:
+            if join:
+                await self.refresh_flight.join()
+            else:
+                await self.refresh_flight.trigger()
+        except Exception as e:
+            logging.error(e)
+
+    def invalidate(self):
+        asyncio.ensure_future(self.refresh(join=False))
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.refresh_interval)
+            await self.refresh()
+
+    async def start(self):
+        if self.refresh_task is None or self.refresh_task.done():
+            first_check = asyncio.ensure_future(self.refresh())
+            try:
+                await asyncio.wait_for(
+                    asyncio.shield(first_check), self.first_check_timeout
+                )
+            except asyncio.TimeoutError:
+                logging.warning(
+                    f"Model artifact not checked within {self.first_check_timeout}s, "
+                    "serving model status before the check completes"
+                )
+            self.refresh_task = asyncio.ensure_future(self.run())
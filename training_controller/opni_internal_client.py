@@ -0,0 +1,102 @@
+# Standard Library
+import asyncio
+import json
+import logging
+import os
+
+# unit: seconds.
+HTTP_REQUEST_TIMEOUT = float(os.getenv("HTTP_REQUEST_TIMEOUT", 5))
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", 10))
+HTTP_MAX_CONCURRENCY = int(os.getenv("HTTP_MAX_CONCURRENCY", 10))
+JSON_HEADERS = {"Content-Type": "application/json", "Accept": "application/json"}
+
+
+class OpniInternalClient:
+    """
+    Async HTTP client for the opni-internal endpoints.
+    A single keep-alive connection pool is shared by every call, each call has its own timeout
+    and the number of requests in flight is bounded so bursts cannot pile up on the gateway.
+    """
+
+    def __init__(
+        self,
+        request_timeout=HTTP_REQUEST_TIMEOUT,
+        max_connections=HTTP_MAX_CONNECTIONS,
+        max_concurrency=HTTP_MAX_CONCURRENCY,
+    ):
+        self.request_timeout = request_timeout
+        self.max_connections = max_connections
+        self.max_concurrency = max_concurrency
+        self.session = None
+        self.semaphore = None
+
+    def get_session(self):
+        # The session is created lazily so it binds to the running event loop.
+        # Third Party
+        import aiohttp
+
+        if self.session is None or self.session.closed:
+            self.session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.max_connections),
+                headers=JSON_HEADERS,
+            )
+            self.semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self.session
+
+    async def request(self, method, url, payload=None, timeout=None):
+        # Third Party
+        import aiohttp
+
+        session = self.get_session()
+        client_timeout = aiohttp.ClientTimeout(total=timeout or self.request_timeout)
+        data = json.dumps(payload).encode() if payload is not None else None
+        async with self.semaphore:
+            async with session.request(
+                method, url, data=data, timeout=client_timeout
+            ) as response:
+                response.raise_for_status()
+                return response.status, await response.read()
+
+    async def get_json(self, url, timeout=None):
+        status, content = await self.request("GET", url, timeout=timeout)
+        return json.loads(content.decode())
+
+    async def put_json(self, url, payload, timeout=None):
+        status, content = await self.request("PUT", url, payload, timeout=timeout)
+        return status
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+
+
+class ModelStatusPoster:
+    """
+    Coalescing queue for model status updates. Statuses which are posted while a previous update
+    is still in flight replace each other, so only the latest status is sent once it completes.
+    """
+
+    def __init__(self, client, endpoint):
+        self.client = client
+        self.endpoint = endpoint
+        self.latest_status = None
+        self.status_event = None
+        self.task = None
+
+    def post(self, status):
+        if self.task is None or self.task.done():
+            self.status_event = asyncio.Event()
+            self.task = asyncio.ensure_future(self.run())
+        self.latest_status = status
+        self.status_event.set()
+
+    async def run(self):
+        while True:
+            await self.status_event.wait()
+            self.status_event.clear()
+            status, self.latest_status = self.latest_status, None
+            try:
+                result = await self.client.put_json(self.endpoint, {"status": status})
+                logging.info(f"Posted training status {status}, result: {result}")
+            except Exception as e:
+                logging.warning(f"Failed to post training status, error: {e}")
@@ -1,424 +1,251 @@
 # Standard Library
+import asyncio
+import json
 import logging
 import os
-import shutil
-import subprocess
 
 # Third Party
-import pandas as pd
-from elasticsearch.helpers import scan
+from controller_metrics import ES_REQUEST_SECONDS, TRAINING_DATA_STAGE_SECONDS
+from dataset_manifest import DatasetManifest
+from disk_budget import DiskBudget, volume_usage
+from interval_reconciliation import (
+    NORMAL_INTERVALS_INDEX,
+    apply_actions,
+    plan_reconciliation,
+)
+from sampling_planner import SamplingPlanner
+from training_data_exporter import TrainingDataExporter
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(message)s")
-ES_ENDPOINT = os.environ["ES_ENDPOINT"]
-ES_USERNAME = os.environ["ES_USERNAME"]
-ES_PASSWORD = os.environ["ES_PASSWORD"]
-FORMATTED_ES_ENDPOINT = (
-    f"https://{ES_USERNAME}:{ES_PASSWORD}@" + ES_ENDPOINT.split("//")[-1]
-)
+# Number of most recent logs used to estimate the average size per log message.
+SAMPLE_LOGS_SIZE = int(os.getenv("SAMPLE_LOGS_SIZE", 10000))
 
 
 class PrepareTrainingLogs:
     def __init__(self):
         self.WORKING_DIR = os.getenv("TRAINING_DATA_PATH", "/var/opni-data")
         self.TRAINING_DIR = os.path.join(self.WORKING_DIR, "windows")
-        self.ES_DUMP_DIR = os.path.join(self.WORKING_DIR, "esdump_path")
-        self.ES_DUMP_SAMPLE_LOGS_PATH = os.path.join(
-            self.WORKING_DIR, "sample_logs.json"
+        self.manifest = None
+        self.average_size_per_log_message = None
+
+    def get_manifest(self):
+        # The manifest is loaded lazily as the training directory may not exist yet.
+        if self.manifest is None:
+            self.manifest = DatasetManifest(self.TRAINING_DIR)
+        return self.manifest
+
+    async def load_manifest(self):
+        # Read the manifest again, in the thread pool as rebuilding it hashes every training file.
+        self.manifest = await asyncio.get_event_loop().run_in_executor(
+            None, DatasetManifest, self.TRAINING_DIR
         )
+        return self.manifest
+
+    def get_disk_budget(self):
+        return DiskBudget(self.TRAINING_DIR, self.get_manifest())
 
     def fetch_disk_size(self):
-        # Fetch size of disk
-        logging.info("Fetching size of the disk")
-        total, used, free = shutil.disk_usage("/")
+        # Fetch size of the volume holding the training data
+        logging.info("Fetching size of the training data volume")
+        total, used, free = volume_usage(self.TRAINING_DIR)
         logging.info("Disk Total: %d GiB" % (total // (2**30)))
         logging.info("Disk Used: %d GiB" % (used // (2**30)))
         logging.info("Disk Free: %d GiB" % (free // (2**30)))
         return free
 
-    def run_esdump(self, query_commands):
-        # Fetch the logs from each time interval within query_commands using Elasticdump.
-        current_processes = set()
-        max_processes = 2
-        while len(query_commands) > 0:
-            finished_processes = set()
-            if len(current_processes) < max_processes:
-                num_processes_to_run = min(
-                    max_processes - len(current_processes), len(query_commands)
+    async def fetch_index_stats_average_log_size(self, es_instance):
+        # Determine average size per log message from the primary store size of the logs index.
+        try:
+            with ES_REQUEST_SECONDS.labels("stats").time():
+                stats = await es_instance.indices.stats(
+                    index="logs", metric="docs,store"
                 )
-                for i in range(num_processes_to_run):
-                    current_query = query_commands.pop(0)
-                    current_processes.add(
-                        subprocess.Popen(
-                            current_query, env={"NODE_TLS_REJECT_UNAUTHORIZED": "0"}
-                        )
-                    )
-            for p in current_processes:
-                if p.poll() is None:
-                    p.wait()
-                else:
-                    finished_processes.add(p)
-            current_processes -= finished_processes
-
-    def retrieve_sample_logs_from_elasticsearch(self):
-        # Get the last 10000 logs from Elasticsearch.
-
-        logging.info("Retrieve sample logs from ES")
-        es_dump_cmd = (
-            'NODE_TLS_REJECT_UNAUTHORIZED=0 elasticdump --searchBody \'{"query": { "match_all": {} }, "_source": ["log", "time"], "sort": [{"time": {"order": "desc"}}]}\' --retryAttempts 10 --size=10000 --limit 10000 --input=%s/logs --output=%s --type=data'
-            % (FORMATTED_ES_ENDPOINT, self.ES_DUMP_SAMPLE_LOGS_PATH)
-        )
-        subprocess.run(es_dump_cmd, shell=True)
-
-        if os.path.exists(self.ES_DUMP_SAMPLE_LOGS_PATH):
-            logging.info("Sampled downloaded successfully")
-        else:
-            logging.error("Sample failed to download")
-
-    def calculate_training_logs_size(self, free):
-        # Determine average size per log message
-        sample_logs_bytes_size = os.path.getsize(self.ES_DUMP_SAMPLE_LOGS_PATH)
-        num_lines = sum(1 for line in open(self.ES_DUMP_SAMPLE_LOGS_PATH))
-        average_size_per_log_message = sample_logs_bytes_size / num_lines
+            primaries = stats["_all"]["primaries"]
+            num_docs = primaries["docs"]["count"]
+            store_bytes_size = primaries["store"]["size_in_bytes"]
+        except Exception as e:
+            logging.error(e)
+            return None
+        if num_docs == 0:
+            return None
+        return store_bytes_size / num_docs
+
+    async def sample_average_log_size(self, es_instance, sample_size=SAMPLE_LOGS_SIZE):
+        """
+        Estimate the average size per log message from the most recent logs in Elasticsearch.
+        Every sampled hit is measured as the JSON line Elasticdump would have written for it,
+        so the estimate matches the old sample file without writing anything to disk.
+        If no logs can be sampled, fall back to the stats of the logs index.
+        """
+        logging.info("Sampling logs from ES")
+        try:
+            with ES_REQUEST_SECONDS.labels("search").time():
+                sample_logs = await es_instance.search(
+                    index="logs",
+                    body={
+                        "query": {"match_all": {}},
+                        "_source": ["log", "time"],
+                        "sort": [{"time": {"order": "desc"}}],
+                    },
+                    size=sample_size,
+                )
+            hits = sample_logs["hits"]["hits"]
+        except Exception as e:
+            logging.error(e)
+            hits = []
+        if len(hits) == 0:
+            logging.warning("No sample logs retrieved, using logs index stats instead")
+            return await self.fetch_index_stats_average_log_size(es_instance)
+        sample_logs_bytes_size = sum(len(json.dumps(hit).encode()) + 1 for hit in hits)
+        return sample_logs_bytes_size / len(hits)
+
+    def calculate_training_logs_size(self, free, average_size_per_log_message):
         logging.info(
             f"average size per log message = {average_size_per_log_message} bytes"
         )
-        os.remove(self.ES_DUMP_SAMPLE_LOGS_PATH)
-        # Determine maximum number of logs to fetch for training
-        num_logs_to_fetch = int((free * 0.8) / average_size_per_log_message)
+        # Determine maximum number of logs to fetch for training, preferring the size per log learned from past exports.
+        disk_budget = self.get_disk_budget()
+        if not disk_budget.bytes_per_log(average_size_per_log_message):
+            logging.error("Unable to determine the average size per log message")
+            return 0
+        num_logs_to_fetch = disk_budget.max_logs(average_size_per_log_message, free)
         logging.info(f"Maximum number of log messages to fetch = {num_logs_to_fetch}")
         return num_logs_to_fetch
 
-    def get_log_count(self, es_instance, timestamps_list, num_logs_to_fetch):
-        # For each of the time intervals, fetch the number of logs present within that span.
-        timestamps_esdump_num_logs_fetched = dict()
-        total_number_of_logs = 0
-        for timestamp_idx, timestamp_entry in enumerate(timestamps_list):
-            start_ts, end_ts = timestamp_entry["start_ts"], timestamp_entry["end_ts"]
-            query_body = {
-                "query": {
-                    "bool": {
-                        "must": {"term": {"is_control_plane_log": "false"}},
-                        "filter": [
-                            {"range": {"timestamp": {"gte": start_ts, "lte": end_ts}}}
-                        ],
-                    }
-                }
-            }
-            try:
-                num_entries = es_instance.count(index="logs", body=query_body)["count"]
-                timestamps_esdump_num_logs_fetched[timestamp_idx] = num_entries
-                total_number_of_logs += num_entries
-            except Exception as e:
-                logging.error(e)
-                continue
-        total_number_of_logs_to_fetch = min(num_logs_to_fetch, total_number_of_logs)
-        if total_number_of_logs > 0:
-            for idx_key in timestamps_esdump_num_logs_fetched:
-                timestamps_esdump_num_logs_fetched[idx_key] /= total_number_of_logs
-                timestamps_esdump_num_logs_fetched[
-                    idx_key
-                ] *= total_number_of_logs_to_fetch
-                timestamps_esdump_num_logs_fetched[idx_key] = int(
-                    timestamps_esdump_num_logs_fetched[idx_key]
-                )
-
-        return timestamps_esdump_num_logs_fetched
-
-    """
-    def fetch_training_logs_from_elasticsearch(
+    async def fetch_training_logs_from_elasticsearch(
         self, es_instance, num_logs_to_fetch, timestamps_list
     ):
-        # This function will customize the Elasticdump query for each interval within timestamps_list and then fetch the logs by calling the run_esdump method.
-
-        timestamps_esdump_num_logs_fetched = self.get_log_count(
-            es_instance, timestamps_list, num_logs_to_fetch
-        )
-        # ESDump logs
-        esdump_sample_command = [
-            "/usr/local/bin/elasticdump",
-            "--searchBody",
-            '{{"query": {{"bool": {{"must": [{{"match":{{"drain_error_keyword":false}}}}, {{"term": {{"is_control_plane_log": false}}}},{{"range": {{"timestamp": {{"gte": {},"lt": {}}}}}}}]}}}} ,"_source": ["masked_log", "timestamp", "is_control_plane_log", "window_start_time_ns", "_id"], "sort": [{{"timestamp": {{"order": "desc"}}}}]}}',
-            "--retryAttempts",
-            "100",
-            "--fileSize=50mb",
-            "--size={}",
-            "--limit",
-            "10000",
-            f"--input={FORMATTED_ES_ENDPOINT}/logs",
-            "--output={}",
-            "--type=data",
-        ]
-        query_queue = []
-        for idx, entry in enumerate(timestamps_list):
-            if timestamps_esdump_num_logs_fetched[idx] == 0:
-                continue
-            start_ts, end_ts, filename = (
-                entry["start_ts"],
-                entry["end_ts"],
-                entry["filename"],
-            )
-            current_command = esdump_sample_command[:]
-            current_command[2] = current_command[2].format(start_ts, end_ts)
-            current_command[6] = current_command[6].format(
-                timestamps_esdump_num_logs_fetched[idx]
-            )
-            current_command[10] = current_command[10].format(
-                os.path.join(self.ES_DUMP_DIR, f"{filename}")
+        # This function will split num_logs_to_fetch across the intervals and workloads within timestamps_list and then export the logs into self.TRAINING_DIR.
+        try:
+            sampling_plan = await SamplingPlanner().plan(
+                es_instance, timestamps_list, num_logs_to_fetch
             )
-            query_queue.append(current_command)
-        # If at least one time interval within timestamps_list has a non zero amount of logs, call the es_dump command and return True
-        if len(query_queue) > 0:
-            self.run_esdump(query_queue)
-            return True
-        else:
+        except Exception as e:
+            logging.error(f"Failed to plan the training logs to fetch, error: {e}")
             return False
-    """
-
-    def fetch_files_with_prefix(self, all_files, prefix):
-        # Return the files within all_files which begin with prefix term.
-        return [file for file in all_files if prefix in file]
+        # If at least one time interval within timestamps_list has a non zero amount of logs, export it and return True
+        if not any(sampling_plan.num_logs_per_interval.values()):
+            return False
+        manifest = self.get_manifest()
+        # The export stops once the disk quota is used up instead of running out of disk.
+        disk_quota = self.get_disk_budget().open_quota(
+            self.average_size_per_log_message
+        )
+        exporter = TrainingDataExporter(
+            es_instance, self.TRAINING_DIR, manifest, disk_quota=disk_quota
+        )
+        with TRAINING_DATA_STAGE_SECONDS.labels("export").time():
+            exported_files = await exporter.export(
+                timestamps_list,
+                sampling_plan.num_logs_per_interval,
+                sampling_plan.workload_quotas
+                if sampling_plan.workload_quotas
+                else None,
+            )
+        manifest.save()
+        return len(exported_files) > 0
 
     def delete_training_data_files(self, interval_json_files):
-        # This function will remove all files listed in interval_json_files from self.TRAINING_DIR
+        # This function will remove all files listed in interval_json_files from self.TRAINING_DIR and the manifest.
         for interval_file in interval_json_files:
-            os.remove(os.path.join(self.TRAINING_DIR, interval_file))
-
-    def update_delete_interval_on_elasticsearch(
-        self, es_instance, normal_interval, flag, updated_ts=None
-    ):
-        # Update or delete interval within opni-normal-intervals index depending on the specified flag, u for update or d for deletion.
-        if flag == "u":
-            try:
-                es_instance.update(
-                    index="opni-normal-intervals",
-                    doc_type=normal_interval["_type"],
-                    id=normal_interval["_id"],
-                    body={"doc": {"start_ts": updated_ts}},
-                )
-                logging.info("Updating time interval within Elasticsearch.")
-                return True
-            except Exception as e:
-                logging.error("Error updating document on opni-normal-intervals index.")
-                return False
-        elif flag == "d":
-            # Delete the old time interval from Elasticsearch index opni-normal-intervals.
             try:
-                es_instance.delete(
-                    index="opni-normal-intervals",
-                    doc_type=normal_interval["_type"],
-                    id=normal_interval["_id"],
-                )
-                logging.info("Deleting old normal time interval from Elasticsearch")
-                return True
-            except Exception as e:
-                logging.error(
-                    "Error deleting document from opni-normal-intervals index."
-                )
-                return False
-        else:
-            logging.error("Invalid flag given!")
-            return False
-
-    def fetch_and_update_timestamps(self, es_instance):
-        # This method will return a list of time intervals that have not already been fetched from Elasticsearch.
-
-        # List that will store dictionaries with three keys: start_ts, end_ts and filename.
-        timestamps_list = []
-        try:
-            # Obtain the oldest and newest logs from Elasticsearch
-            oldest_log = es_instance.search(
+                os.remove(os.path.join(self.TRAINING_DIR, interval_file))
+            except FileNotFoundError:
+                logging.warning(f"Training data file {interval_file} already removed")
+        self.get_manifest().remove_files(interval_json_files)
+
+    async def fetch_log_timestamp_bounds(self, es_instance):
+        # Return the timestamps of the oldest and newest logs, both from a single aggregation.
+        with ES_REQUEST_SECONDS.labels("search").time():
+            result = await es_instance.search(
                 index="logs",
                 body={
-                    "aggs": {"min_ts": {"min": {"field": "timestamp"}}},
-                    "_source": ["timestamp"],
+                    "size": 0,
+                    "aggs": {
+                        "min_ts": {"min": {"field": "timestamp"}},
+                        "max_ts": {"max": {"field": "timestamp"}},
+                    },
                 },
-                size=1,
-            )
-            newest_log = es_instance.search(
-                index="logs",
-                body={
-                    "aggs": {"max_ts": {"max": {"field": "timestamp"}}},
-                    "_source": ["timestamp"],
-                },
-                size=1,
             )
+        oldest_log_timestamp = result["aggregations"]["min_ts"]["value"]
+        newest_log_timestamp = result["aggregations"]["max_ts"]["value"]
+        if oldest_log_timestamp is None or newest_log_timestamp is None:
+            return None
+        return int(oldest_log_timestamp), int(newest_log_timestamp)
+
+    async def fetch_and_update_timestamps(self, es_instance):
+        # This method will return a list of time intervals that have not already been fetched from Elasticsearch.
+        try:
+            timestamp_bounds = await self.fetch_log_timestamp_bounds(es_instance)
         except Exception as e:
             logging.error(e)
-            return timestamps_list
-        # Retrieve the oldest and newest log timestamps.
-        oldest_log_timestamp = int(oldest_log["aggregations"]["min_ts"]["value"])
-        newest_log_timestamp = int(newest_log["aggregations"]["max_ts"]["value"])
+            return []
+        if timestamp_bounds is None:
+            logging.info("There are no logs in Elasticsearch")
+            return []
+        oldest_log_timestamp, newest_log_timestamp = timestamp_bounds
+        # Third Party
+        from elasticsearch.helpers import async_scan
+
         # Retrieve all the current normal training intervals from Elasticsearch.
         try:
-            all_normal_intervals = scan(
-                es_instance,
-                index="opni-normal-intervals",
-                query={"query": {"match_all": {}}},
-            )
+            with ES_REQUEST_SECONDS.labels("scan").time():
+                all_normal_intervals = [
+                    normal_interval
+                    async for normal_interval in async_scan(
+                        es_instance,
+                        index=NORMAL_INTERVALS_INDEX,
+                        query={"query": {"match_all": {}}},
+                    )
+                ]
         except Exception as e:
             logging.error(
                 "Error trying to retrieve all normal intervals from opni-normal-intervals index"
             )
-            return timestamps_list
-        # Retrieve all of the files currently stored in self.TRAINING_DIR
-        all_training_files = os.listdir(self.TRAINING_DIR)
-        for normal_interval in all_normal_intervals:
-            start_ts, end_ts = (
-                normal_interval["_source"]["start_ts"],
-                normal_interval["_source"]["end_ts"],
-            )
-            full_file_prefix = f"{start_ts}_{end_ts}"
-
-            # Fetch only the files within the all_training_files list which contain the full_file_prefix.
-            interval_json_files = self.fetch_files_with_prefix(
-                all_training_files, full_file_prefix
-            )
-
-            # If the end_ts is before the oldest_log_timestamp, then that interval should be removed from Elasticsearch as the data no longer exists.
-            if end_ts < oldest_log_timestamp:
-                # Delete interval within opni-normal-intervals index.
-                is_success = self.update_delete_interval_on_elasticsearch(
-                    es_instance, normal_interval, "d"
-                )
-                if is_success:
-                    self.delete_training_data_files(interval_json_files)
-                else:
-                    continue
-            # Address scenarios where start_ts comes before the oldest_log_timestamp
-            elif start_ts < oldest_log_timestamp:
-                """
-                If end_ts is after the newest_log_timestamp, then set the start_ts to oldest_log_timestamp,
-                keep the end_ts the same and set the filename to be named with the oldest_log_timestamp and
-                newest_log_timestamp. Otherwise, set the filename to be named after the oldest_log_timestamp and end_ts.
-                """
-                if end_ts > newest_log_timestamp:
-                    timestamps_list.append(
-                        {
-                            "start_ts": oldest_log_timestamp,
-                            "end_ts": end_ts,
-                            "filename": "{}_{}.json".format(
-                                oldest_log_timestamp, newest_log_timestamp
-                            ),
-                        }
-                    )
-                else:
-                    timestamps_list.append(
-                        {
-                            "start_ts": oldest_log_timestamp,
-                            "end_ts": end_ts,
-                            "filename": "{}_{}.json".format(
-                                oldest_log_timestamp, end_ts
-                            ),
-                        }
-                    )
-
-                # Update start_ts value to oldest_log_timestamp.
-                is_success = self.update_delete_interval_on_elasticsearch(
-                    es_instance, normal_interval, "u", oldest_log_timestamp
-                )
-                if is_success:
-                    logging.info(
-                        "Removing old JSON training files where the time interval within opni-normal-intervals was updated."
-                    )
-                    self.delete_training_data_files(interval_json_files)
-                else:
-                    continue
-
-            # Address scenario where start_ts is on or after oldest_log_timestamp and end_ts is after newest_log_timestamp.
-            elif end_ts > newest_log_timestamp:
-                # Set the filename to be named with the start_ts amd newest_log_timestamp
-                timestamps_list.append(
-                    {
-                        "start_ts": start_ts,
-                        "end_ts": end_ts,
-                        "filename": f"{start_ts}_{newest_log_timestamp}.json",
-                    }
-                )
-
-            # Address scenario where start_ts is on or after oldest_log_timestamp and end_ts is before or on newest_log_timestamp.
-            else:
-                # If there already exist files with the filename prefix, do not fetch that data again.
-                if len(interval_json_files) == 0:
-                    # Fetch the files within self.TRAINING_DIR that contain just the start_ts in its name
-                    start_ts_interval_json_files = self.fetch_files_with_prefix(
-                        all_training_files, str(start_ts)
-                    )
-                    logging.info(
-                        "Removing old JSON training files with the same starting timestamp but updated ending timestamp."
-                    )
-                    self.delete_training_data_files(start_ts_interval_json_files)
-                    timestamps_list.append(
-                        {
-                            "start_ts": start_ts,
-                            "end_ts": end_ts,
-                            "filename": f"{start_ts}_{end_ts}.json",
-                        }
-                    )
-
-        return timestamps_list
-
-    def normalize_json_data(self):
-        # For every json file obtained through Elasticdump, normalize the _source field and dump that result into the self.TRAINING_DIR directory.
-        for es_split_json_file in os.listdir(self.ES_DUMP_DIR):
-            if not ".json" in es_split_json_file:
-                continue
-            json_file_to_process = os.path.join(self.ES_DUMP_DIR, es_split_json_file)
-            df = pd.read_json(json_file_to_process, lines=True)
-            df = pd.json_normalize(df["_source"])
-            df[
-                [
-                    "timestamp",
-                    "window_start_time_ns",
-                    "masked_log",
-                    "is_control_plane_log",
-                ]
-            ].to_json(
-                os.path.join(
-                    self.TRAINING_DIR,
-                    "{}.json.gz".format(es_split_json_file.split(".json")[0]),
-                ),
-                orient="records",
-                lines=True,
-                compression="gzip",
+            return []
+        # The manifest indexes all of the files currently stored in self.TRAINING_DIR by time window.
+        manifest = self.get_manifest()
+        plan = plan_reconciliation(
+            all_normal_intervals, oldest_log_timestamp, newest_log_timestamp, manifest
+        )
+        if plan.stale_files:
+            logging.info(
+                "Removing old JSON training files with the same starting timestamp but updated ending timestamp."
             )
-            # delete ESDumped file
-            os.remove(json_file_to_process)
-        # Delete the ES_DUMP_DIR as well.
-        shutil.rmtree(self.ES_DUMP_DIR)
-
-    """
-    def run(self):
-        if not os.path.exists(self.ES_DUMP_DIR):
-            os.makedirs(self.ES_DUMP_DIR)
-
+            self.delete_training_data_files(plan.stale_files)
+        # The files of an updated or deleted interval are only removed once Elasticsearch acknowledged it.
+        for action in await apply_actions(es_instance, plan.actions):
+            self.delete_training_data_files(action.files)
+        manifest.save()
+        return plan.timestamps_list
+
+    async def run(self, es_instance):
+        # Not called by the controller, the GPU service fetches its training logs with the query of
+        # the train payload. Kept to export the training windows into TRAINING_DIR on demand.
         if not os.path.exists(self.TRAINING_DIR):
             os.makedirs(self.TRAINING_DIR)
-        es_instance = Elasticsearch(
-            [ES_ENDPOINT],
-            port=9200,
-            http_auth=(ES_USERNAME, ES_PASSWORD),
-            verify_certs=False,
-            use_ssl=True,
-        )
-        free = self.fetch_disk_size()
-        self.retrieve_sample_logs_from_elasticsearch()
-        num_logs_to_fetch = self.calculate_training_logs_size(free)
-        timestamps_list = self.fetch_and_update_timestamps(es_instance)
-        data_exists = self.fetch_training_logs_from_elasticsearch(
+        # get_num_logs_for_training reloads the manifest off the event loop for the steps below.
+        num_logs_to_fetch = await self.get_num_logs_for_training(es_instance)
+        timestamps_list = await self.fetch_and_update_timestamps(es_instance)
+        data_exists = await self.fetch_training_logs_from_elasticsearch(
             es_instance, num_logs_to_fetch, timestamps_list
         )
-        if data_exists:
-            self.normalize_json_data()
         return data_exists
-    """
-
-    def get_num_logs_for_training(self):
-        if not os.path.exists(self.ES_DUMP_DIR):
-            os.makedirs(self.ES_DUMP_DIR)
 
+    async def get_num_logs_for_training(self, es_instance, free=None, manifest=None):
+        # free and manifest may be passed by a caller which already measured and loaded them.
         if not os.path.exists(self.TRAINING_DIR):
             os.makedirs(self.TRAINING_DIR)
-        free = self.fetch_disk_size()
-        self.retrieve_sample_logs_from_elasticsearch()
-        num_logs_to_fetch = self.calculate_training_logs_size(free)
+        if free is None:
+            free = self.fetch_disk_size()
+        # The budget learns from the files exported since it was last computed.
+        if manifest is None:
+            await self.load_manifest()
+        else:
+            self.manifest = manifest
+        average_size_per_log_message = await self.sample_average_log_size(es_instance)
+        self.average_size_per_log_message = average_size_per_log_message
+        num_logs_to_fetch = self.calculate_training_logs_size(
+            free, average_size_per_log_message
+        )
         return num_logs_to_fetch
@@ -0,0 +1,168 @@
+# Standard Library
+import logging
+import os
+
+# Third Party
+from controller_metrics import ES_REQUEST_SECONDS
+from training_data_exporter import training_logs_query
+
+STRATIFIED_SAMPLING = os.getenv("STRATIFIED_SAMPLING", "true").lower() == "true"
+# Maximum number of logs sampled from one workload, 0 disables the cap.
+WORKLOAD_SAMPLE_CAP = int(os.getenv("WORKLOAD_SAMPLE_CAP", 100000))
+# Number of workload buckets returned per interval by one composite aggregation page.
+WORKLOAD_COUNTS_PAGE_SIZE = int(os.getenv("WORKLOAD_COUNTS_PAGE_SIZE", 1000))
+# A workload is identified by these fields, logs without one of them form their own workload.
+WORKLOAD_FIELDS = ["cluster_id", "namespace_name.keyword", "deployment.keyword"]
+
+
+def workload_filter(workload):
+    # The filter clauses selecting the logs of a workload, a tuple of WORKLOAD_FIELDS values.
+    clauses = []
+    for field, value in zip(WORKLOAD_FIELDS, workload):
+        if value is None:
+            clauses.append({"bool": {"must_not": {"exists": {"field": field}}}})
+        else:
+            clauses.append({"term": {field: value}})
+    return clauses
+
+
+def fair_share(budget, demands):
+    """
+    Split budget between the keys of demands without giving any key more than its demand.
+    Keys are served from the smallest demand up, each getting at most an even share of what is
+    left, so a few large demands cannot crowd out the small ones.
+    """
+    shares = dict()
+    remaining = budget
+    sorted_demands = sorted(demands.items(), key=lambda item: item[1])
+    for idx, (key, demand) in enumerate(sorted_demands):
+        shares[key] = min(demand, remaining // (len(sorted_demands) - idx))
+        remaining -= shares[key]
+    return shares
+
+
+class SamplingPlan:
+    """
+    Number of logs to fetch per interval and, when sampling is stratified, the quotas of the
+    workloads within every interval as lists of (workload filter clauses, number of logs).
+    """
+
+    def __init__(self):
+        self.num_logs_per_interval = dict()
+        self.workload_quotas = dict()
+
+
+class SamplingPlanner:
+    """
+    Plan how many training logs to fetch from every (interval, workload) pair.
+    The log counts of all pairs are read in one _msearch holding a size-0 composite aggregation
+    on the workload fields per interval. max_logs_for_training is shared fairly between the
+    workloads, each capped at workload_sample_cap logs, and the quota of a workload is spread
+    over the intervals in proportion to its logs there. Without stratification the budget is
+    split between the intervals in proportion to their logs.
+    """
+
+    def __init__(
+        self,
+        stratified=STRATIFIED_SAMPLING,
+        workload_sample_cap=WORKLOAD_SAMPLE_CAP,
+        page_size=WORKLOAD_COUNTS_PAGE_SIZE,
+    ):
+        self.stratified = stratified
+        self.workload_sample_cap = workload_sample_cap
+        self.page_size = page_size
+
+    def counts_search(self, interval, after_key=None):
+        composite = {
+            "size": self.page_size,
+            "sources": [
+                {field: {"terms": {"field": field, "missing_bucket": True}}}
+                for field in WORKLOAD_FIELDS
+            ],
+        }
+        if after_key is not None:
+            composite["after"] = after_key
+        return {
+            "size": 0,
+            "track_total_hits": True,
+            "query": training_logs_query(interval["start_ts"], interval["end_ts"]),
+            "aggs": {"workloads": {"composite": composite}},
+        }
+
+    async def fetch_counts(self, es_instance, timestamps_list):
+        # Return {interval index: {workload: number of logs}}, paging every interval in turn.
+        counts = {idx: dict() for idx in range(len(timestamps_list))}
+        after_keys = {idx: None for idx in range(len(timestamps_list))}
+        while after_keys:
+            pending = list(after_keys)
+            msearch_body = []
+            for idx in pending:
+                msearch_body.append({"index": "logs"})
+                msearch_body.append(
+                    self.counts_search(timestamps_list[idx], after_keys[idx])
+                )
+            with ES_REQUEST_SECONDS.labels("msearch").time():
+                result = await es_instance.msearch(body=msearch_body)
+            after_keys = dict()
+            for idx, response in zip(pending, result["responses"]):
+                if "error" in response:
+                    logging.error(f"Failed to count logs of interval {idx}: {response}")
+                    counts.pop(idx, None)
+                    continue
+                aggregation = response["aggregations"]["workloads"]
+                for bucket in aggregation["buckets"]:
+                    workload = tuple(bucket["key"][field] for field in WORKLOAD_FIELDS)
+                    counts[idx][workload] = bucket["doc_count"]
+                if len(aggregation["buckets"]) == self.page_size:
+                    after_keys[idx] = aggregation["after_key"]
+        return counts
+
+    def plan_by_interval(self, counts, max_logs_for_training):
+        plan = SamplingPlan()
+        interval_counts = {idx: sum(counts[idx].values()) for idx in counts}
+        total_number_of_logs = sum(interval_counts.values())
+        total_number_of_logs_to_fetch = min(max_logs_for_training, total_number_of_logs)
+        for idx, interval_count in interval_counts.items():
+            plan.num_logs_per_interval[idx] = (
+                interval_count * total_number_of_logs_to_fetch // total_number_of_logs
+                if total_number_of_logs > 0
+                else 0
+            )
+        return plan
+
+    def plan_by_workload(self, counts, max_logs_for_training):
+        plan = SamplingPlan()
+        workload_counts = dict()
+        for interval_counts in counts.values():
+            for workload, count in interval_counts.items():
+                workload_counts[workload] = workload_counts.get(workload, 0) + count
+        demands = {
+            workload: (
+                min(count, self.workload_sample_cap)
+                if self.workload_sample_cap > 0
+                else count
+            )
+            for workload, count in workload_counts.items()
+        }
+        workload_budgets = fair_share(max_logs_for_training, demands)
+        for idx, interval_counts in counts.items():
+            quotas = []
+            for workload, count in sorted(
+                interval_counts.items(), key=lambda item: str(item[0])
+            ):
+                quota = workload_budgets[workload] * count // workload_counts[workload]
+                if quota > 0:
+                    quotas.append((workload_filter(workload), quota))
+            plan.workload_quotas[idx] = quotas
+            plan.num_logs_per_interval[idx] = sum(quota for _, quota in quotas)
+        logging.info(
+            f"Sampling {sum(workload_budgets.values())} of {sum(workload_counts.values())} logs "
+            f"from {len(workload_counts)} workloads"
+        )
+        return plan
+
+    async def plan(self, es_instance, timestamps_list, max_logs_for_training):
+        counts = await self.fetch_counts(es_instance, timestamps_list)
+        if self.stratified:
+            return self.plan_by_workload(counts, max_logs_for_training)
+        return self.plan_by_interval(counts, max_logs_for_training)
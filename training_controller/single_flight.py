@@ -0,0 +1,72 @@
+# Standard Library
+import asyncio
+import logging
+
+
+class SingleFlight:
+    """
+    Coalesce concurrent calls of a coroutine function.
+    Only one run is in flight at a time. A trigger with the same key as the run in flight
+    joins it. Any other trigger arriving during a run collapses into a single follow-up run,
+    which starts once the current run completes and uses the key of the latest trigger.
+    join waits for the latest run already started or pending, and only starts one if none is.
+    """
+
+    def __init__(self, run):
+        self.run = run
+        self.current_key = None
+        self.current_future = None
+        self.pending_key = None
+        self.pending_future = None
+
+    def start(self, key):
+        self.current_key = key
+        self.current_future = asyncio.ensure_future(self.run())
+        self.current_future.add_done_callback(self.on_done)
+        return self.current_future
+
+    def on_done(self, future):
+        self.current_key = None
+        self.current_future = None
+        if self.pending_future is None:
+            return
+        pending_future, self.pending_future = self.pending_future, None
+        logging.info("Starting the follow-up run of the coalesced triggers")
+        self.start(self.pending_key).add_done_callback(
+            lambda run_future: copy_result(run_future, pending_future)
+        )
+
+    async def trigger(self, key=None):
+        if self.current_future is None:
+            future = self.start(key)
+        elif (
+            key is not None and key == self.current_key and self.pending_future is None
+        ):
+            logging.info("Joining the run in flight")
+            future = self.current_future
+        else:
+            if self.pending_future is None:
+                self.pending_future = asyncio.get_event_loop().create_future()
+            self.pending_key = key
+            future = self.pending_future
+        return await asyncio.shield(future)
+
+    async def join(self):
+        if self.pending_future is not None:
+            future = self.pending_future
+        elif self.current_future is not None:
+            future = self.current_future
+        else:
+            future = self.start(None)
+        return await asyncio.shield(future)
+
+
+def copy_result(source_future, target_future):
+    if target_future.done():
+        return
+    if source_future.cancelled():
+        target_future.cancel()
+    elif source_future.exception() is not None:
+        target_future.set_exception(source_future.exception())
+    else:
+        target_future.set_result(source_future.result())
@@ -0,0 +1,145 @@
+# Standard Library
+import asyncio
+import json
+import logging
+import os
+import time
+
+# Third Party
+from controller_metrics import ES_REQUEST_SECONDS
+from prepare_training_logs import PrepareTrainingLogs
+
+# unit: seconds.
+BUDGET_CACHE_TTL = int(os.getenv("BUDGET_CACHE_TTL", 1800))
+# Relative change of free disk space which invalidates the cached budget.
+BUDGET_CACHE_DISK_CHANGE_THRESHOLD = float(
+    os.getenv("BUDGET_CACHE_DISK_CHANGE_THRESHOLD", 0.05)
+)
+# Relative change of the logs index document count which invalidates the cached budget.
+BUDGET_CACHE_DOC_COUNT_CHANGE_THRESHOLD = float(
+    os.getenv("BUDGET_CACHE_DOC_COUNT_CHANGE_THRESHOLD", 0.2)
+)
+# Relative change of the size per log learned from the exported files which invalidates the cached budget.
+BUDGET_CACHE_LOG_SIZE_CHANGE_THRESHOLD = float(
+    os.getenv("BUDGET_CACHE_LOG_SIZE_CHANGE_THRESHOLD", 0.1)
+)
+
+
+def relative_change(previous_value, current_value):
+    if previous_value == 0:
+        return 0 if current_value == 0 else 1
+    return abs(current_value - previous_value) / previous_value
+
+
+class TrainingBudgetCache:
+    """
+    Persistent cache of max_logs_for_training. The estimate is reused until the TTL expires,
+    the free disk space changes past a threshold, the logs index document count shifts a lot or
+    the size per log learned from the exported files changes.
+    The cache is stored within the training data directory so it survives restarts, and is
+    read in the thread pool on first use.
+    """
+
+    def __init__(
+        self,
+        ttl=BUDGET_CACHE_TTL,
+        disk_change_threshold=BUDGET_CACHE_DISK_CHANGE_THRESHOLD,
+        doc_count_change_threshold=BUDGET_CACHE_DOC_COUNT_CHANGE_THRESHOLD,
+        log_size_change_threshold=BUDGET_CACHE_LOG_SIZE_CHANGE_THRESHOLD,
+    ):
+        self.ttl = ttl
+        self.disk_change_threshold = disk_change_threshold
+        self.doc_count_change_threshold = doc_count_change_threshold
+        self.log_size_change_threshold = log_size_change_threshold
+        self.prepare_training_logs = PrepareTrainingLogs()
+        self.cache_path = os.path.join(
+            self.prepare_training_logs.WORKING_DIR, "training_budget_cache.json"
+        )
+        self.lock = asyncio.Lock()
+        self.entry = None
+        self.loaded = False
+
+    def load(self):
+        try:
+            with open(self.cache_path) as cache_file:
+                return json.load(cache_file)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logging.warning(f"Ignoring unreadable training budget cache: {e}")
+            return None
+
+    def save(self):
+        try:
+            tmp_cache_path = f"{self.cache_path}.tmp"
+            with open(tmp_cache_path, "w") as cache_file:
+                json.dump(self.entry, cache_file)
+            os.replace(tmp_cache_path, self.cache_path)
+        except Exception as e:
+            logging.warning(f"Failed to persist training budget cache: {e}")
+
+    def is_valid(self, free, doc_count, bytes_per_log):
+        if self.entry is None:
+            return False
+        if time.time() - self.entry["computed_at"] > self.ttl:
+            logging.info("Training budget cache expired")
+            return False
+        if relative_change(self.entry["free"], free) > self.disk_change_threshold:
+            logging.info("Free disk space changed, recomputing training budget")
+            return False
+        if (
+            doc_count is None
+            or relative_change(self.entry["doc_count"], doc_count)
+            > self.doc_count_change_threshold
+        ):
+            logging.info(
+                "Logs index document count changed, recomputing training budget"
+            )
+            return False
+        cached_bytes_per_log = self.entry.get("bytes_per_log")
+        if (cached_bytes_per_log is None) != (bytes_per_log is None) or (
+            bytes_per_log is not None
+            and relative_change(cached_bytes_per_log, bytes_per_log)
+            > self.log_size_change_threshold
+        ):
+            logging.info("Learned size per log changed, recomputing training budget")
+            return False
+        return True
+
+    async def fetch_doc_count(self, es_instance):
+        try:
+            with ES_REQUEST_SECONDS.labels("count").time():
+                return (await es_instance.count(index="logs"))["count"]
+        except Exception as e:
+            logging.error(e)
+            return None
+
+    async def get_num_logs_for_training(self, es_instance):
+        loop = asyncio.get_event_loop()
+        async with self.lock:
+            if not self.loaded:
+                self.entry = await loop.run_in_executor(None, self.load)
+                self.loaded = True
+            free = self.prepare_training_logs.fetch_disk_size()
+            doc_count = await self.fetch_doc_count(es_instance)
+            manifest = await self.prepare_training_logs.load_manifest()
+            bytes_per_log = self.prepare_training_logs.get_disk_budget().bytes_per_log()
+            if self.is_valid(free, doc_count, bytes_per_log):
+                logging.info("Using cached training budget")
+                return self.entry["max_logs_for_training"]
+            max_logs_for_training = (
+                await self.prepare_training_logs.get_num_logs_for_training(
+                    es_instance, free, manifest
+                )
+            )
+            # Only cache budgets which could be measured against a known document count.
+            if max_logs_for_training > 0 and doc_count is not None:
+                self.entry = {
+                    "max_logs_for_training": max_logs_for_training,
+                    "free": free,
+                    "doc_count": doc_count,
+                    "bytes_per_log": bytes_per_log,
+                    "computed_at": time.time(),
+                }
+                await loop.run_in_executor(None, self.save)
+            return max_logs_for_training
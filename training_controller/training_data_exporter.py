@@ -0,0 +1,258 @@
+# Standard Library
+import asyncio
+import logging
+import math
+import os
+
+# Third Party
+from controller_metrics import ES_REQUEST_SECONDS, TRAINING_DATA_BYTES_WRITTEN
+from training_data_writers import (
+    TRAINING_DATA_OUTPUT_FORMAT,
+    TRAINING_FIELDS,
+    open_dedup_state,
+    open_training_data_writer,
+)
+
+EXPORT_WORKERS = int(os.getenv("EXPORT_WORKERS", os.cpu_count() or 2))
+EXPORT_PAGE_SIZE = int(os.getenv("EXPORT_PAGE_SIZE", 10000))
+EXPORT_PIT_KEEP_ALIVE = os.getenv("EXPORT_PIT_KEEP_ALIVE", "5m")
+
+
+def training_logs_query(start_ts, end_ts):
+    return {
+        "bool": {
+            "must": [
+                {"match": {"drain_error_keyword": False}},
+                {"term": {"is_control_plane_log": False}},
+                {"range": {"timestamp": {"gte": start_ts, "lt": end_ts}}},
+            ]
+        }
+    }
+
+
+def split_evenly(total, num_parts):
+    # Split total into num_parts integers which differ by at most one.
+    return [
+        total // num_parts + (1 if i < total % num_parts else 0)
+        for i in range(num_parts)
+    ]
+
+
+class TrainingDataExporter:
+    """
+    Export the training logs of a list of time intervals from Elasticsearch.
+    Every interval is read through its own point in time, split into slices which are paged
+    with search_after. When workload quotas are given, a slice instead reads a share of the
+    workloads of the interval, each up to its quota. The pages of all slices share a pool of
+    export workers, and each slice projects the training fields and writes them in the training
+    data output format straight into output_dir. With a disk quota, every page is reserved
+    against it first and the export stops cleanly, keeping the files written, once it is used up.
+    """
+
+    def __init__(
+        self,
+        es_instance,
+        output_dir,
+        manifest=None,
+        workers=EXPORT_WORKERS,
+        page_size=EXPORT_PAGE_SIZE,
+        pit_keep_alive=EXPORT_PIT_KEEP_ALIVE,
+        output_format=TRAINING_DATA_OUTPUT_FORMAT,
+        disk_quota=None,
+    ):
+        self.es_instance = es_instance
+        self.output_dir = output_dir
+        self.manifest = manifest
+        self.workers = max(1, workers)
+        self.page_size = page_size
+        self.pit_keep_alive = pit_keep_alive
+        self.output_format = output_format
+        self.disk_quota = disk_quota
+        self.worker_semaphore = None
+        self.interval_semaphore = None
+
+    async def fetch_page(self, search_body):
+        # Every page holds an export worker, so the slices of all intervals progress in turn.
+        async with self.worker_semaphore:
+            with ES_REQUEST_SECONDS.labels("search").time():
+                return await self.es_instance.search(body=search_body)
+
+    async def export_query(self, writer, pit_id, query, num_logs, slice_spec=None):
+        # Page through the logs of query within the point in time and write num_logs of them.
+        loop = asyncio.get_event_loop()
+        num_written = 0
+        search_after = None
+        while num_written < num_logs:
+            page_size = min(self.page_size, num_logs - num_written)
+            if self.disk_quota is not None and not self.disk_quota.reserve(page_size):
+                break
+            search_body = {
+                "query": query,
+                "pit": {"id": pit_id, "keep_alive": self.pit_keep_alive},
+                "sort": [{"timestamp": "desc"}, {"_shard_doc": "asc"}],
+                "_source": TRAINING_FIELDS,
+                "size": page_size,
+                "track_total_hits": False,
+            }
+            if slice_spec is not None:
+                search_body["slice"] = slice_spec
+            if search_after is not None:
+                search_body["search_after"] = search_after
+            result = await self.fetch_page(search_body)
+            hits = result["hits"]["hits"]
+            if self.disk_quota is not None:
+                self.disk_quota.release(page_size - len(hits))
+            if len(hits) == 0:
+                break
+            pit_id = result.get("pit_id", pit_id)
+            search_after = hits[-1]["sort"]
+            records = [
+                {field: hit["_source"].get(field) for field in TRAINING_FIELDS}
+                for hit in hits
+            ]
+            # Encoding and compression run on the thread pool to keep the event loop free.
+            await loop.run_in_executor(None, writer.write_records, records)
+            num_written += len(records)
+        return pit_id
+
+    async def export_slice(
+        self, pit_id, slice_queries, output_path_stem, dedup_state=None
+    ):
+        # Write the logs of every (query, num_logs, slice_spec) of slice_queries into one file.
+        # Return its path, or None when it got no row, with its number of rows and records.
+        writer = open_training_data_writer(
+            output_path_stem, self.output_format, dedup_state=dedup_state
+        )
+        try:
+            for query, num_logs, slice_spec in slice_queries:
+                pit_id = await self.export_query(
+                    writer, pit_id, query, num_logs, slice_spec
+                )
+        except BaseException:
+            writer.abort()
+            raise
+        # The last slice of an interval to be closed also writes the rows its dedup state holds.
+        output_path = writer.close()
+        if output_path is not None:
+            TRAINING_DATA_BYTES_WRITTEN.inc(os.path.getsize(output_path))
+        return output_path, writer.num_rows, writer.num_records
+
+    def add_to_manifest(self, exported_slices):
+        # The records of the slices whose logs were all deduplicated into the rows of other slices
+        # are counted with the first file of the interval.
+        unwritten_records = sum(
+            num_records
+            for output_path, _, num_records in exported_slices
+            if output_path is None
+        )
+        for output_path, num_rows, num_records in exported_slices:
+            if output_path is None:
+                continue
+            self.manifest.add_file(
+                output_path, num_rows, num_records + unwritten_records
+            )
+            unwritten_records = 0
+
+    def plan_slices(self, query, num_logs, workload_quotas=None):
+        # Return the list of slice_queries of every slice of an interval.
+        if workload_quotas is None:
+            # Split the interval into sliced scrolls of the point in time.
+            num_slices = max(1, min(self.workers, math.ceil(num_logs / self.page_size)))
+            return [
+                [
+                    (
+                        query,
+                        slice_num_logs,
+                        {"id": slice_id, "max": num_slices} if num_slices > 1 else None,
+                    )
+                ]
+                for slice_id, slice_num_logs in enumerate(
+                    split_evenly(num_logs, num_slices)
+                )
+            ]
+        # Give every slice a share of the workloads, largest quotas first to the emptiest slice.
+        num_slices = max(
+            1,
+            min(
+                self.workers, math.ceil(num_logs / self.page_size), len(workload_quotas)
+            ),
+        )
+        slices = [[] for _ in range(num_slices)]
+        slice_num_logs = [0] * num_slices
+        for filters, quota in sorted(workload_quotas, key=lambda item: -item[1]):
+            slice_id = slice_num_logs.index(min(slice_num_logs))
+            workload_query = {"bool": dict(query["bool"], filter=filters)}
+            slices[slice_id].append((workload_query, quota, None))
+            slice_num_logs[slice_id] += quota
+        return slices
+
+    async def export_interval(self, interval, num_logs, workload_quotas=None):
+        async with self.interval_semaphore:
+            return await self.export_interval_with_pit(
+                interval, num_logs, workload_quotas
+            )
+
+    async def export_interval_with_pit(self, interval, num_logs, workload_quotas=None):
+        start_ts, end_ts, filename = (
+            interval["start_ts"],
+            interval["end_ts"],
+            interval["filename"],
+        )
+        file_stem = filename.split(".json")[0]
+        slices = self.plan_slices(
+            training_logs_query(start_ts, end_ts), num_logs, workload_quotas
+        )
+        # The slice files of the interval deduplicate their templates together.
+        dedup_state = open_dedup_state(len(slices))
+        pit = await self.es_instance.open_point_in_time(
+            index="logs", keep_alive=self.pit_keep_alive
+        )
+        try:
+            exported_slices = await asyncio.gather(
+                *[
+                    self.export_slice(
+                        pit["id"],
+                        slice_queries,
+                        os.path.join(self.output_dir, f"{file_stem}.slice-{slice_id}"),
+                        dedup_state,
+                    )
+                    for slice_id, slice_queries in enumerate(slices)
+                ]
+            )
+        finally:
+            try:
+                await self.es_instance.close_point_in_time(body={"id": pit["id"]})
+            except Exception as e:
+                logging.warning(f"Failed to close point in time, error: {e}")
+        if self.manifest is not None:
+            await asyncio.get_event_loop().run_in_executor(
+                None, self.add_to_manifest, exported_slices
+            )
+        return [
+            os.path.basename(output_path)
+            for output_path, _, _ in exported_slices
+            if output_path is not None
+        ]
+
+    async def export(
+        self, timestamps_list, num_logs_per_interval, workload_quotas=None
+    ):
+        # Export every interval with a non zero number of logs and return the files written.
+        # With workload_quotas, every interval only holds the quotas of its workloads.
+        self.worker_semaphore = asyncio.Semaphore(self.workers)
+        # Bound the number of points in time which are kept open at once.
+        self.interval_semaphore = asyncio.Semaphore(self.workers)
+        interval_exports = [
+            self.export_interval(
+                interval,
+                num_logs_per_interval[idx],
+                workload_quotas.get(idx) if workload_quotas is not None else None,
+            )
+            for idx, interval in enumerate(timestamps_list)
+            if num_logs_per_interval.get(idx, 0) > 0
+        ]
+        exported_files = []
+        for interval_files in await asyncio.gather(*interval_exports):
+            exported_files.extend(interval_files)
+        logging.info(f"Exported {len(exported_files)} training data files")
+        return exported_files
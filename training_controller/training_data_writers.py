@@ -0,0 +1,302 @@
+# Standard Library
+import gzip
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+# Either "json" for gzip JSON lines or "parquet" for columnar Parquet files.
+TRAINING_DATA_OUTPUT_FORMAT = os.getenv("TRAINING_DATA_OUTPUT_FORMAT", "json")
+PARQUET_ROW_GROUP_SIZE = int(os.getenv("PARQUET_ROW_GROUP_SIZE", 100000))
+PARQUET_COMPRESSION = os.getenv("PARQUET_COMPRESSION", "zstd")
+TRAINING_FIELDS = [
+    "timestamp",
+    "window_start_time_ns",
+    "masked_log",
+    "is_control_plane_log",
+]
+# Deduplication of masked_log templates within every training window: "off", "count" to keep
+# one row per template with its occurrence_count, or "copies" to keep up to a number of copies.
+TRAINING_DATA_DEDUP = os.getenv("TRAINING_DATA_DEDUP", "off")
+# Number of templates tracked per window, see DedupWriter for which ones are evicted beyond it.
+TRAINING_DATA_DEDUP_CAPACITY = int(os.getenv("TRAINING_DATA_DEDUP_CAPACITY", 100000))
+TRAINING_DATA_DEDUP_MAX_COPIES = int(os.getenv("TRAINING_DATA_DEDUP_MAX_COPIES", 3))
+
+
+class TrainingDataWriter:
+    """
+    Base class of the training data writers. Records are written to a temporary file which is
+    only moved to its final path once the writer is closed, so readers never see partial files.
+    A writer closed without any record drops its file and returns None.
+    """
+
+    extension = ""
+
+    def __init__(self, output_path_stem, with_occurrence_count=False):
+        self.path = output_path_stem + self.extension
+        self.tmp_path = f"{self.path}.tmp"
+        self.num_records = 0
+
+    @property
+    def num_rows(self):
+        return self.num_records
+
+    def write_records(self, records):
+        raise NotImplementedError
+
+    def finish(self):
+        raise NotImplementedError
+
+    def close(self):
+        if self.num_records == 0:
+            self.abort()
+            return None
+        self.finish()
+        os.replace(self.tmp_path, self.path)
+        return self.path
+
+    def abort(self):
+        self.finish()
+        os.remove(self.tmp_path)
+
+
+class JsonLinesGzipWriter(TrainingDataWriter):
+    extension = ".json.gz"
+
+    def __init__(self, output_path_stem, with_occurrence_count=False):
+        super().__init__(output_path_stem)
+        self.output = gzip.open(self.tmp_path, "wt")
+
+    def write_records(self, records):
+        self.output.write("".join(json.dumps(record) + "\n" for record in records))
+        self.num_records += len(records)
+
+    def finish(self):
+        self.output.close()
+
+
+def to_int(value):
+    return int(value) if value is not None else None
+
+
+def to_bool(value):
+    if isinstance(value, str):
+        return value.lower() == "true"
+    return bool(value) if value is not None else None
+
+
+class ParquetWriter(TrainingDataWriter):
+    """
+    Write the training fields as Parquet. masked_log is dictionary encoded, timestamps are stored
+    as int64 columns and every row group keeps min/max statistics so readers can prune by time.
+    """
+
+    extension = ".parquet"
+
+    def __init__(
+        self,
+        output_path_stem,
+        with_occurrence_count=False,
+        row_group_size=PARQUET_ROW_GROUP_SIZE,
+        compression=PARQUET_COMPRESSION,
+    ):
+        # pyarrow is only needed when the Parquet output format is selected.
+        # Third Party
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        super().__init__(output_path_stem)
+        self.pa = pa
+        self.row_group_size = row_group_size
+        self.with_occurrence_count = with_occurrence_count
+        fields = [
+            ("timestamp", pa.int64()),
+            ("window_start_time_ns", pa.int64()),
+            ("masked_log", pa.dictionary(pa.int32(), pa.string())),
+            ("is_control_plane_log", pa.bool_()),
+        ]
+        if with_occurrence_count:
+            fields.append(("occurrence_count", pa.int64()))
+        self.schema = pa.schema(fields)
+        self.output = pq.ParquetWriter(
+            self.tmp_path,
+            self.schema,
+            compression=compression,
+            use_dictionary=["masked_log"],
+            write_statistics=True,
+        )
+        self.pending_records = []
+
+    def flush_row_group(self):
+        records, self.pending_records = self.pending_records, []
+        columns = {
+            "timestamp": [to_int(record.get("timestamp")) for record in records],
+            "window_start_time_ns": [
+                to_int(record.get("window_start_time_ns")) for record in records
+            ],
+            "masked_log": [record.get("masked_log") for record in records],
+            "is_control_plane_log": [
+                to_bool(record.get("is_control_plane_log")) for record in records
+            ],
+        }
+        if self.with_occurrence_count:
+            columns["occurrence_count"] = [
+                to_int(record.get("occurrence_count")) for record in records
+            ]
+        table = self.pa.Table.from_pydict(columns, schema=self.schema)
+        self.output.write_table(table, row_group_size=self.row_group_size)
+
+    def write_records(self, records):
+        self.pending_records.extend(records)
+        self.num_records += len(records)
+        while len(self.pending_records) >= self.row_group_size:
+            remaining_records = self.pending_records[self.row_group_size :]
+            self.pending_records = self.pending_records[: self.row_group_size]
+            self.flush_row_group()
+            self.pending_records = remaining_records
+
+    def finish(self):
+        if self.pending_records:
+            self.flush_row_group()
+        self.output.close()
+
+
+class DedupState:
+    """
+    masked_log templates tracked by the DedupWriters of one training window, e.g. the slice files
+    of an exported interval, so a template is deduplicated once per window rather than once per
+    file. Templates are tracked by the BLAKE2b digest of masked_log, at most capacity of them, so
+    memory does not depend on the size of the window. The writers run on executor threads, so
+    the templates are only accessed under the lock. num_writers is the number of writers sharing
+    the state, the last of them to be closed writes the records still held in "count" mode.
+    """
+
+    def __init__(
+        self,
+        mode,
+        num_writers=1,
+        capacity=TRAINING_DATA_DEDUP_CAPACITY,
+        max_copies=TRAINING_DATA_DEDUP_MAX_COPIES,
+    ):
+        if mode not in ("count", "copies"):
+            raise ValueError(f"Unsupported training data dedup mode: {mode}")
+        self.mode = mode
+        self.capacity = capacity
+        self.max_copies = max_copies
+        self.templates = OrderedDict()
+        self.lock = threading.Lock()
+        self.open_writers = num_writers
+
+    def track(self, record):
+        # Return the tracked entry of the template of record and the entries evicted for it.
+        masked_log = record.get("masked_log")
+        key = (
+            hashlib.blake2b(masked_log.encode(), digest_size=16).digest()
+            if masked_log is not None
+            else None
+        )
+        entry = self.templates.get(key)
+        if entry is None:
+            entry = dict(record, occurrence_count=0) if self.mode == "count" else [0]
+            self.templates[key] = entry
+        elif self.mode == "copies":
+            self.templates.move_to_end(key)
+        evicted_entries = []
+        while len(self.templates) > self.capacity:
+            evicted_entries.append(self.templates.popitem(last=False)[1])
+        return entry, evicted_entries
+
+    def dedup(self, records):
+        # Return the records to write out of records.
+        output_records = []
+        with self.lock:
+            for record in records:
+                entry, evicted_entries = self.track(record)
+                if self.mode == "count":
+                    entry["occurrence_count"] += 1
+                    output_records.extend(evicted_entries)
+                elif entry[0] < self.max_copies:
+                    entry[0] += 1
+                    output_records.append(record)
+        return output_records
+
+    def detach(self):
+        # Return the records still held once the last writer detached, else an empty list.
+        with self.lock:
+            self.open_writers -= 1
+            if self.open_writers > 0:
+                return []
+            held_records = list(self.templates.values()) if self.mode == "count" else []
+            self.templates.clear()
+            return held_records
+
+
+class DedupWriter:
+    """
+    Deduplicate the masked_log templates of the records written to a training data writer
+    against a DedupState. In "count" mode the first record of every template is held with an
+    occurrence_count. Held records are written in the order they were first seen, the oldest
+    once capacity is exceeded and the rest by the last writer of the state to be closed, so the
+    rows keep the order of the records, e.g. the descending timestamps of the exporter.
+    A template seen again after its record was written starts a new one. In "copies" mode the
+    first max_copies records of every template are written as they arrive, and the least
+    recently seen templates are forgotten beyond capacity.
+    num_records counts the records given to the writer, i.e. the logs the file represents, and
+    num_rows the rows written to the file.
+    """
+
+    def __init__(self, writer, state):
+        self.writer = writer
+        self.path = writer.path
+        self.state = state
+        self.num_records = 0
+
+    @property
+    def num_rows(self):
+        return self.writer.num_records
+
+    def write_records(self, records):
+        self.num_records += len(records)
+        output_records = self.state.dedup(records)
+        if output_records:
+            self.writer.write_records(output_records)
+
+    def close(self):
+        held_records = self.state.detach()
+        if held_records:
+            self.writer.write_records(held_records)
+        return self.writer.close()
+
+    def abort(self):
+        self.state.detach()
+        self.writer.abort()
+
+
+TRAINING_DATA_WRITERS = {"json": JsonLinesGzipWriter, "parquet": ParquetWriter}
+
+
+def open_dedup_state(num_writers, dedup=TRAINING_DATA_DEDUP):
+    # Return the DedupState shared by the num_writers writers of a window, None without dedup.
+    if dedup == "off":
+        return None
+    return DedupState(dedup, num_writers)
+
+
+def open_training_data_writer(
+    output_path_stem,
+    output_format=TRAINING_DATA_OUTPUT_FORMAT,
+    dedup=TRAINING_DATA_DEDUP,
+    dedup_state=None,
+):
+    # Writers given the same dedup_state deduplicate their records together.
+    if output_format not in TRAINING_DATA_WRITERS:
+        raise ValueError(f"Unsupported training data output format: {output_format}")
+    if dedup_state is not None:
+        dedup = dedup_state.mode
+    if dedup == "off":
+        return TRAINING_DATA_WRITERS[output_format](output_path_stem)
+    writer = TRAINING_DATA_WRITERS[output_format](
+        output_path_stem, with_occurrence_count=dedup == "count"
+    )
+    return DedupWriter(writer, dedup_state or DedupState(dedup))
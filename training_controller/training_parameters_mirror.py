@@ -0,0 +1,108 @@
+# Standard Library
+import asyncio
+import json
+import logging
+import os
+
+# Third Party
+from nats.js.errors import KeyNotFoundError
+
+MODEL_TRAINING_PARAMETERS_BUCKET = "model-training-parameters"
+MODEL_TRAINING_PARAMETERS_KEY = "modelTrainingParameters"
+LAST_MODEL_TRAINED_KEY = "lastModelTrained"
+# unit: seconds. Delay before a failed watch is restarted, the keys are read once meanwhile.
+MIRROR_RETRY_INTERVAL = float(os.getenv("MIRROR_RETRY_INTERVAL", 5))
+
+
+class TrainingParametersMirror:
+    """
+    In-memory mirror of the model training parameters in NATS KV.
+    Every mirrored key is followed by a KV watch, which delivers its current value first and then
+    every update. The decoded value and revision of each key are kept in memory, and on_change is
+    called in the background with the key and its value whenever a newer revision arrives.
+    When a watch fails, the key is read once and the watch is restarted after a delay.
+    """
+
+    def __init__(
+        self,
+        nw,
+        on_change=None,
+        bucket_name=MODEL_TRAINING_PARAMETERS_BUCKET,
+        keys=(MODEL_TRAINING_PARAMETERS_KEY, LAST_MODEL_TRAINED_KEY),
+        retry_interval=MIRROR_RETRY_INTERVAL,
+    ):
+        self.nw = nw
+        self.on_change = on_change
+        self.bucket_name = bucket_name
+        self.keys = keys
+        self.retry_interval = retry_interval
+        self.values = dict()
+        self.revisions = dict()
+        self.loaded_keys = set()
+        self.loaded = asyncio.Event()
+        self.watch_tasks = dict()
+
+    def get(self, key):
+        return self.values.get(key)
+
+    def is_loaded(self):
+        return self.loaded.is_set()
+
+    def mark_loaded(self, key):
+        self.loaded_keys.add(key)
+        if self.loaded_keys.issuperset(self.keys):
+            self.loaded.set()
+
+    def update(self, key, payload, revision):
+        # Apply a value of key and notify on_change if it is newer than the mirrored one.
+        if revision is not None and revision <= self.revisions.get(key, 0):
+            return
+        try:
+            value = json.loads(payload.decode()) if payload else None
+        except ValueError as e:
+            logging.error(f"Ignoring undecodable value of {key}, error: {e}")
+            return
+        self.values[key] = value
+        self.revisions[key] = revision or self.revisions.get(key, 0)
+        logging.info(f"Mirrored {key} at revision {revision}")
+        if self.on_change is not None:
+            asyncio.ensure_future(self.on_change(key, value))
+
+    async def read_key(self, kv, key):
+        # Return whether the current value of key could be read.
+        try:
+            entry = await kv.get(key)
+        except KeyNotFoundError:
+            return True
+        except Exception as e:
+            logging.warning(f"Failed to read {key}, error: {e}")
+            return False
+        self.update(key, entry.value, entry.revision)
+        return True
+
+    async def watch_key(self, key):
+        while True:
+            kv = None
+            try:
+                kv = (await self.nw.get_bucket(self.bucket_name)).kv
+                watcher = await kv.watch(key)
+                async for entry in watcher:
+                    # The watch delivers None once the current value has been delivered.
+                    if entry is None:
+                        self.mark_loaded(key)
+                        continue
+                    if entry.operation in ("DEL", "PURGE"):
+                        self.update(key, None, entry.revision)
+                    else:
+                        self.update(key, entry.value, entry.revision)
+                logging.warning(f"Watch of {key} stopped")
+            except Exception as e:
+                logging.error(f"Watch of {key} failed, error: {e}")
+                if kv is not None and await self.read_key(kv, key):
+                    self.mark_loaded(key)
+            await asyncio.sleep(self.retry_interval)
+
+    def start(self):
+        for key in self.keys:
+            if key not in self.watch_tasks or self.watch_tasks[key].done():
+                self.watch_tasks[key] = asyncio.ensure_future(self.watch_key(key))
@@ -0,0 +1,149 @@
+# Standard Library
+import asyncio
+import hashlib
+import logging
+import os
+import time
+from collections import OrderedDict
+
+# Third Party
+import orjson
+
+TRAINING_PAYLOAD_OFFLOAD = (
+    os.getenv("TRAINING_PAYLOAD_OFFLOAD", "false").lower() == "true"
+)
+TRAINING_PAYLOAD_BUCKET = os.getenv("TRAINING_PAYLOAD_BUCKET", "training-payloads")
+# unit: bytes. Payloads up to this size are still published inline.
+TRAINING_PAYLOAD_INLINE_LIMIT = int(os.getenv("TRAINING_PAYLOAD_INLINE_LIMIT", 65536))
+# unit: bytes. Size of the KV values a payload is split into, below the NATS max_payload.
+TRAINING_PAYLOAD_CHUNK_SIZE = int(os.getenv("TRAINING_PAYLOAD_CHUNK_SIZE", 524288))
+# unit: seconds. Stored payloads which no running job refers to are deleted after this.
+TRAINING_PAYLOAD_TTL = float(os.getenv("TRAINING_PAYLOAD_TTL", 86400))
+
+
+def payload_digest(payload_bytes):
+    return hashlib.sha256(payload_bytes).hexdigest()
+
+
+def summarize_training_payload(payload):
+    # A short description of a train payload for the logs, in place of the payload itself.
+    workloads = payload.get("parameters", {}).get("workloads", {})
+    num_deployments = sum(
+        len(deployments)
+        for namespaces in workloads.values()
+        for deployments in namespaces.values()
+    )
+    return (
+        f"max_size : {payload.get('max_size')}, count : {payload.get('count')}, "
+        f"clusters : {len(workloads)}, deployments : {num_deployments}"
+    )
+
+
+class TrainingPayloadStore:
+    """
+    Store train payloads out of line in NATS KV, keyed by the SHA-256 digest of their content.
+    A payload is split into chunks stored under {digest}.{index}, and the key {digest} records
+    the number of chunks and the size once all chunks are written. The message published instead
+    of the payload is a compact reference {"payload_ref": {"bucket", "key", "size"}}, which the
+    GPU service resolves by concatenating the chunks listed by the key and checking the digest.
+    A stored payload is deleted once the training job it was scheduled with ends, or after ttl
+    seconds if no running job refers to it, e.g. when it was never scheduled or the job was
+    scheduled by another replica.
+    """
+
+    def __init__(
+        self,
+        nw,
+        enabled=TRAINING_PAYLOAD_OFFLOAD,
+        bucket_name=TRAINING_PAYLOAD_BUCKET,
+        inline_limit=TRAINING_PAYLOAD_INLINE_LIMIT,
+        chunk_size=TRAINING_PAYLOAD_CHUNK_SIZE,
+        ttl=TRAINING_PAYLOAD_TTL,
+    ):
+        self.nw = nw
+        self.enabled = enabled
+        self.bucket_name = bucket_name
+        self.inline_limit = inline_limit
+        self.chunk_size = chunk_size
+        self.ttl = ttl
+        self.stored_at = OrderedDict()
+        self.job_payloads = dict()
+
+    async def get_bucket(self):
+        bucket = await self.nw.get_bucket(self.bucket_name)
+        if bucket is None:
+            bucket = await self.nw.create_bucket(self.bucket_name)
+        return bucket
+
+    async def put(self, payload_bytes):
+        # Store payload_bytes and return its reference.
+        digest = payload_digest(payload_bytes)
+        bucket = await self.get_bucket()
+        # A payload published again, e.g. on a retry, is only stored once.
+        if await bucket.get(digest) is None:
+            num_chunks = 0
+            for offset in range(0, len(payload_bytes), self.chunk_size):
+                await bucket.put(
+                    f"{digest}.{num_chunks}",
+                    payload_bytes[offset : offset + self.chunk_size],
+                )
+                num_chunks += 1
+            # The digest key is written last, so a reference is only resolvable when complete.
+            await bucket.put(
+                digest,
+                orjson.dumps({"chunks": num_chunks, "size": len(payload_bytes)}),
+            )
+        self.stored_at[digest] = time.time()
+        self.stored_at.move_to_end(digest)
+        await self.expire(bucket)
+        return {"bucket": self.bucket_name, "key": digest, "size": len(payload_bytes)}
+
+    async def expire(self, bucket):
+        # Delete the payloads stored more than ttl seconds ago which no running job refers to.
+        referenced_digests = set(self.job_payloads.values())
+        expired_before = time.time() - self.ttl
+        for digest, stored_at in list(self.stored_at.items()):
+            if stored_at > expired_before:
+                break
+            if digest not in referenced_digests:
+                del self.stored_at[digest]
+                await self.delete(bucket, digest)
+
+    def claim(self, job_id, payload):
+        # Record that the job was scheduled with payload, if it is a reference to this store.
+        payload_ref = payload.get("payload_ref") if isinstance(payload, dict) else None
+        if payload_ref is not None and payload_ref.get("bucket") == self.bucket_name:
+            self.job_payloads[job_id] = payload_ref["key"]
+
+    def release(self, job_id):
+        # Delete the payload of a job which ended, unless another running job refers to it.
+        digest = self.job_payloads.pop(job_id, None)
+        if digest is None or digest in self.job_payloads.values():
+            return
+        self.stored_at.pop(digest, None)
+        asyncio.ensure_future(self.delete_released(digest))
+
+    async def delete_released(self, digest):
+        await self.delete(await self.get_bucket(), digest)
+
+    async def delete(self, bucket, digest):
+        try:
+            index = orjson.loads(await bucket.get(digest))
+            await bucket.delete(digest)
+            for chunk in range(index["chunks"]):
+                await bucket.delete(f"{digest}.{chunk}")
+        except Exception as e:
+            logging.warning(
+                f"Failed to delete stored train payload {digest}, error: {e}"
+            )
+
+    async def encode(self, payload):
+        # Encode a train payload as a message, storing it out of line when it is too large.
+        payload_bytes = orjson.dumps(payload)
+        if not self.enabled or len(payload_bytes) <= self.inline_limit:
+            return payload_bytes
+        payload_ref = await self.put(payload_bytes)
+        logging.info(
+            f"Stored train payload of {len(payload_bytes)} bytes as {payload_ref['key']}"
+        )
+        return orjson.dumps({"payload_ref": payload_ref})
@@ -0,0 +1,74 @@
+# Standard Library
+import os
+from collections import OrderedDict
+
+# Third Party
+from workload_fingerprint import WorkloadTree
+
+TRAINING_QUERY_CACHE_SIZE = int(os.getenv("TRAINING_QUERY_CACHE_SIZE", 16))
+
+
+class TrainingQueryCompiler:
+    """
+    Compile the Elasticsearch query selecting the training logs of a set of workloads.
+    Deployments are grouped into one terms filter per cluster and namespace on keyword fields
+    instead of one query_string clause per deployment. The compiled workload clauses are cached
+    under the WorkloadTree root digest of the workload set, which callers that already built the
+    tree pass as workloads_key, so repeated triggers only rebuild the time range.
+    """
+
+    def __init__(self, anomaly_keywords, cache_size=TRAINING_QUERY_CACHE_SIZE):
+        # The keywords are matched as one analyzed match query on the log field.
+        self.anomaly_keywords_clause = {
+            "match": {"log": {"query": " ".join(anomaly_keywords), "operator": "or"}}
+        }
+        self.cache_size = cache_size
+        self.workload_clauses_cache = OrderedDict()
+
+    def compile_workload_clauses(self, workloads):
+        workload_clauses = []
+        for cluster_id in sorted(workloads):
+            for namespace_name in sorted(workloads[cluster_id]):
+                deployment_names = sorted(workloads[cluster_id][namespace_name])
+                if len(deployment_names) == 0:
+                    continue
+                workload_clauses.append(
+                    {
+                        "bool": {
+                            "filter": [
+                                {"term": {"cluster_id": cluster_id}},
+                                {"term": {"namespace_name.keyword": namespace_name}},
+                                {"terms": {"deployment.keyword": deployment_names}},
+                            ]
+                        }
+                    }
+                )
+        return workload_clauses
+
+    def get_workload_clauses(self, workloads, workloads_key=None):
+        if workloads_key is None:
+            workloads_key = WorkloadTree(workloads).root_digest
+        if workloads_key in self.workload_clauses_cache:
+            self.workload_clauses_cache.move_to_end(workloads_key)
+            return self.workload_clauses_cache[workloads_key]
+        workload_clauses = self.compile_workload_clauses(workloads)
+        self.workload_clauses_cache[workloads_key] = workload_clauses
+        if len(self.workload_clauses_cache) > self.cache_size:
+            self.workload_clauses_cache.popitem(last=False)
+        return workload_clauses
+
+    def compile(self, workloads, start_ts, end_ts, workloads_key=None):
+        # The cached clauses are shared between queries, so the returned body must not be mutated.
+        return {
+            "query": {
+                "bool": {
+                    "filter": [{"range": {"time": {"gte": start_ts, "lte": end_ts}}}],
+                    "minimum_should_match": 1,
+                    "should": self.get_workload_clauses(workloads, workloads_key),
+                    "must_not": [
+                        {"match": {"anomaly_level.keyword": "Anomaly"}},
+                        self.anomaly_keywords_clause,
+                    ],
+                },
+            }
+        }
@@ -0,0 +1,146 @@
+# Standard Library
+import hashlib
+
+# Number of added and removed deployments shown when a workload delta is logged.
+DELTA_LOG_SAMPLE_SIZE = 5
+
+
+def digest(*parts):
+    sha256 = hashlib.sha256()
+    for part in parts:
+        sha256.update(part.encode())
+        sha256.update(b"\0")
+    return sha256.hexdigest()
+
+
+class WorkloadTree:
+    """
+    Merkle-style fingerprint of a workloads dict of {cluster_id: {namespace_name: [deployment_name]}}.
+    Every namespace is hashed over its sorted deployments, every cluster over its sorted namespace
+    digests and the root over the sorted cluster digests, so equal subtrees can be skipped when
+    two workload sets are compared.
+    """
+
+    def __init__(self, workloads):
+        self.workloads = workloads
+        self.namespace_digests = dict()
+        self.cluster_digests = dict()
+        for cluster_id in workloads:
+            self.namespace_digests[cluster_id] = {
+                namespace_name: digest(*sorted(set(deployment_names)))
+                for namespace_name, deployment_names in workloads[cluster_id].items()
+            }
+            self.cluster_digests[cluster_id] = digest(
+                *[
+                    f"{namespace_name}:{namespace_digest}"
+                    for namespace_name, namespace_digest in sorted(
+                        self.namespace_digests[cluster_id].items()
+                    )
+                ]
+            )
+        self.root_digest = digest(
+            *[
+                f"{cluster_id}:{cluster_digest}"
+                for cluster_id, cluster_digest in sorted(self.cluster_digests.items())
+            ]
+        )
+
+    def deployments(self, cluster_id, namespace_name=None):
+        # Yield (cluster_id, namespace_name, deployment_name) for every deployment of a subtree.
+        namespace_names = (
+            [namespace_name]
+            if namespace_name is not None
+            else list(self.workloads[cluster_id])
+        )
+        for current_namespace_name in namespace_names:
+            for deployment_name in self.workloads[cluster_id][current_namespace_name]:
+                yield cluster_id, current_namespace_name, deployment_name
+
+
+def sample(deployments, size=DELTA_LOG_SAMPLE_SIZE):
+    shown = ", ".join(
+        "/".join(map(str, deployment)) for deployment in deployments[:size]
+    )
+    if len(deployments) > size:
+        shown += f", ... {len(deployments) - size} more"
+    return f"[{shown}]"
+
+
+class WorkloadDelta:
+    """
+    Difference between two workload sets. added and removed list the changed deployments as
+    (cluster_id, namespace_name, deployment_name) tuples. unchanged lists the subtrees which are
+    identical in both sets, as (cluster_id,) or (cluster_id, namespace_name) tuples.
+    """
+
+    def __init__(self):
+        self.added = []
+        self.removed = []
+        self.unchanged = []
+
+    def has_changes(self):
+        return len(self.added) > 0 or len(self.removed) > 0
+
+    def __str__(self):
+        # Only a sample of the deployments, the lists can hold a whole fleet.
+        return (
+            f"added : {len(self.added)} {sample(self.added)}, "
+            f"removed : {len(self.removed)} {sample(self.removed)}, "
+            f"unchanged subtrees : {len(self.unchanged)}"
+        )
+
+
+def diff_workloads(previous_tree, current_tree):
+    delta = WorkloadDelta()
+    if previous_tree.root_digest == current_tree.root_digest:
+        delta.unchanged = [(cluster_id,) for cluster_id in current_tree.cluster_digests]
+        return delta
+    for cluster_id in (
+        current_tree.cluster_digests.keys() - previous_tree.cluster_digests.keys()
+    ):
+        delta.added.extend(current_tree.deployments(cluster_id))
+    for cluster_id in (
+        previous_tree.cluster_digests.keys() - current_tree.cluster_digests.keys()
+    ):
+        delta.removed.extend(previous_tree.deployments(cluster_id))
+    for cluster_id in (
+        current_tree.cluster_digests.keys() & previous_tree.cluster_digests.keys()
+    ):
+        if (
+            current_tree.cluster_digests[cluster_id]
+            == previous_tree.cluster_digests[cluster_id]
+        ):
+            delta.unchanged.append((cluster_id,))
+            continue
+        current_namespaces = current_tree.namespace_digests[cluster_id]
+        previous_namespaces = previous_tree.namespace_digests[cluster_id]
+        for namespace_name in current_namespaces.keys() - previous_namespaces.keys():
+            delta.added.extend(current_tree.deployments(cluster_id, namespace_name))
+        for namespace_name in previous_namespaces.keys() - current_namespaces.keys():
+            delta.removed.extend(previous_tree.deployments(cluster_id, namespace_name))
+        for namespace_name in current_namespaces.keys() & previous_namespaces.keys():
+            if (
+                current_namespaces[namespace_name]
+                == previous_namespaces[namespace_name]
+            ):
+                delta.unchanged.append((cluster_id, namespace_name))
+                continue
+            current_deployments = set(
+                current_tree.workloads[cluster_id][namespace_name]
+            )
+            previous_deployments = set(
+                previous_tree.workloads[cluster_id][namespace_name]
+            )
+            delta.added.extend(
+                (cluster_id, namespace_name, deployment_name)
+                for deployment_name in sorted(
+                    current_deployments - previous_deployments
+                )
+            )
+            delta.removed.extend(
+                (cluster_id, namespace_name, deployment_name)
+                for deployment_name in sorted(
+                    previous_deployments - current_deployments
+                )
+            )
+    return delta